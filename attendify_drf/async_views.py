@@ -0,0 +1,19 @@
+from asgiref.sync import sync_to_async
+
+
+def _save(serializer, kwargs):
+    if not serializer.is_valid():
+        return False
+    serializer.save(**kwargs)
+    # Rendered here too, since representations may query the database (e.g. recent visits)
+    serializer.data
+    return True
+
+
+async def asave(serializer, **kwargs):
+    """
+    Validates and saves ``serializer`` and renders its data in a single trip to
+    a sync thread, for async views. Returns whether the data was valid; the
+    result is then in ``serializer.data`` or ``serializer.errors``.
+    """
+    return await sync_to_async(_save)(serializer, kwargs)
@@ -0,0 +1,106 @@
+from functools import wraps
+from inspect import iscoroutinefunction
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+
+# Versions the cached responses of a namespace's views without a pk
+LISTS = 'lists'
+
+
+def version_key(namespace, pk=None):
+    if pk is None:
+        return f'responses:{namespace}:version'
+    return f'responses:{namespace}:{pk}:version'
+
+
+def get_version(namespace, pk=None):
+    version = cache.get(version_key(namespace, pk))
+    if version is None:
+        cache.add(version_key(namespace, pk), 1, timeout=None)
+        version = cache.get(version_key(namespace, pk), 1)
+    return version
+
+
+async def aget_version(namespace, pk=None):
+    version = await cache.aget(version_key(namespace, pk))
+    if version is None:
+        await cache.aadd(version_key(namespace, pk), 1, timeout=None)
+        version = await cache.aget(version_key(namespace, pk), 1)
+    return version
+
+
+def bump_version(namespace, pk=None):
+    try:
+        cache.incr(version_key(namespace, pk))
+    except ValueError:
+        cache.add(version_key(namespace, pk), 1, timeout=None)
+
+
+def invalidate_version(namespace, pk=None):
+    """
+    Bumps a version immediately and again once the transaction commits, so a
+    read that cached pre-commit data in between is discarded as well.
+    """
+    bump_version(namespace, pk)
+    transaction.on_commit(lambda: bump_version(namespace, pk))
+
+
+def invalidate_cached_responses(namespace, pk=None):
+    """
+    Makes every cached response in ``namespace`` unreachable by bumping its
+    version, or with ``pk`` only the responses of that object's detail view
+    and the namespace's lists, which may embed it.
+    """
+    invalidate_version(namespace, pk)
+    if pk is not None:
+        invalidate_version(namespace, LISTS)
+
+
+def cached_response(namespace, timeout=None):
+    """
+    Caches the data of successful GET responses, keyed by path and query string,
+    for ``timeout`` seconds (``RESPONSE_CACHE_TIMEOUT`` by default). Entries
+    are invalidated through ``invalidate_cached_responses(namespace)``, and
+    also through ``invalidate_cached_responses(namespace, pk)``: those of views
+    taking that ``pk`` and those of views without one.
+    Works on both sync and async view methods.
+    """
+    def response_key(version, view_version, request):
+        return 'responses:{}:{}.{}:{}?{}'.format(
+            namespace, version, view_version, request.path, urlencode(sorted(request.GET.lists()), doseq=True)
+        )
+
+    def decorator(method):
+        if iscoroutinefunction(method):
+            @wraps(method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                key = response_key(
+                    await aget_version(namespace), await aget_version(namespace, kwargs.get('pk', LISTS)), request,
+                )
+                data = await cache.aget(key)
+                if data is not None:
+                    return Response(data, status=status.HTTP_200_OK)
+                response = await method(self, request, *args, **kwargs)
+                if response.status_code == status.HTTP_200_OK:
+                    await cache.aset(key, response.data, timeout=timeout or settings.RESPONSE_CACHE_TIMEOUT)
+                return response
+            return async_wrapper
+
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = response_key(get_version(namespace), get_version(namespace, kwargs.get('pk', LISTS)), request)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data, status=status.HTTP_200_OK)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, timeout=timeout or settings.RESPONSE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -1,22 +1,178 @@
 # your_app_name/consumers.py
 
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from urllib.parse import parse_qs
+import asyncio
 import json
+import re
+
+from .events import TOPICS, dispatcher, topic_group
+
+TOPIC_VALUE_RE = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
 
 class MyConsumer(AsyncWebsocketConsumer):
+    # Upper bounds for the opt-in batching mode, so a client can't ask for unbounded latency or frames
+    max_batch_window = 1000  # milliseconds
+    max_batch_size = 500
+    # Ids of recently delivered events (with the delivered item indexes of bulk events), used to drop
+    # copies arriving through several subscribed topics
+    max_recent_events = 1000
+
     async def connect(self):
+        self.configure_batching(parse_qs(self.scope.get('query_string', b'').decode()))
+        self.frame_buffer = []
+        self.flush_task = None
+        self.groups_joined = set()
+        self.recent_events = {}
+        self.heartbeat_task = None
         await self.accept()
-        await self.channel_layer.group_add('broadcast', self.channel_name)
+        await self.join_groups({'broadcast'})
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard('broadcast', self.channel_name)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        await self.leave_groups(set(self.groups_joined))
+
+    async def heartbeat(self):
+        # Renews the subscriptions well before the dispatcher would consider them gone
+        while True:
+            await asyncio.sleep(dispatcher.subscriber_ttl / 3)
+            await sync_to_async(dispatcher.subscribe)(self.channel_name, set(self.groups_joined))
+
+    def configure_batching(self, params):
+        """
+        Clients opt into batching with ``?batch_window=<ms>&batch_size=<n>``.
+        Buffered events are then sent as one JSON array frame once the window
+        elapses or the buffer is full, whichever comes first.
+        """
+        try:
+            batch_window = int(params.get('batch_window', ['0'])[0])
+            batch_size = int(params.get('batch_size', ['100'])[0])
+        except ValueError:
+            batch_window, batch_size = 0, 1
+        self.batch_window = min(max(batch_window, 0), self.max_batch_window) / 1000
+        self.batch_size = min(max(batch_size, 1), self.max_batch_size)
 
     async def receive(self, text_data):
-        # Handle incoming messages from the WebSocket if needed
-        pass
+        """
+        Clients narrow what they receive by subscribing to topics, e.g.
+        ``{"action": "subscribe", "topics": ["event:employee_attendance", "device:3"]}``.
+        Topics are ``event``, ``employee``, ``device`` and ``client``; an event
+        is delivered if it matches any subscribed topic. A connection with no
+        subscriptions receives every event.
+        """
+        try:
+            message = json.loads(text_data)
+            action = message['action']
+            if action not in ('subscribe', 'unsubscribe'):
+                raise ValueError(action)
+            groups = [self.parse_topic(topic) for topic in message['topics']]
+        except (ValueError, KeyError, TypeError):
+            await self.send(text_data=json.dumps({
+                'event': 'error',
+                'data': {'detail': 'Expected {"action": "subscribe" | "unsubscribe", "topics": ["<topic>:<value>", ...]}'},
+            }))
+            return
 
-    async def send_event(self, event):
+        if action == 'subscribe':
+            await self.join_groups(set(groups) - self.groups_joined)
+            await self.leave_groups({'broadcast'} & self.groups_joined)
+        else:
+            await self.leave_groups(set(groups) & self.groups_joined)
+            if not self.groups_joined:
+                await self.join_groups({'broadcast'})
         await self.send(text_data=json.dumps({
-            'event': event['event'],
-            'data': event['data'],
+            'event': 'subscriptions',
+            'data': {'topics': sorted(group.replace('.', ':', 1) for group in self.groups_joined)},
         }))
+
+    def parse_topic(self, topic):
+        if not isinstance(topic, str):
+            raise TypeError(topic)
+        kind, value = topic.split(':', 1)
+        if kind not in TOPICS or not TOPIC_VALUE_RE.match(value):
+            raise ValueError(topic)
+        return topic_group(kind, value)
+
+    async def join_groups(self, groups):
+        for group in groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.groups_joined |= groups
+        # The dispatcher skips groups nobody has joined
+        await sync_to_async(dispatcher.subscribe)(self.channel_name, groups)
+
+    async def leave_groups(self, groups):
+        for group in groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups_joined -= groups
+        await sync_to_async(dispatcher.unsubscribe)(self.channel_name, groups)
+
+    def remember_event(self, event_id, delivered=None):
+        self.recent_events[event_id] = delivered
+        if len(self.recent_events) > self.max_recent_events:
+            del self.recent_events[next(iter(self.recent_events))]
+
+    def is_duplicate(self, event):
+        event_id = event.get('id')
+        if event_id is None:
+            return False
+        if event_id in self.recent_events:
+            return True
+        self.remember_event(event_id)
+        return False
+
+    def undelivered_items(self, event):
+        """The items of a bulk event's slice that no other slice has delivered to this socket yet."""
+        delivered = self.recent_events.get(event['id']) or set()
+        items = [item for index, item in zip(event['indexes'], event['items']) if index not in delivered]
+        self.remember_event(event['id'], delivered | set(event['indexes']))
+        return items
+
+    def event_frame(self, event):
+        if 'frame' in event:
+            return None if self.is_duplicate(event) else event['frame']
+        items = self.undelivered_items(event)
+        if not items:
+            return None
+        # Items are already JSON, so the frame is assembled without re-encoding them
+        return '{"event": ' + json.dumps(event['event']) + ', "data": [' + ', '.join(items) + ']}'
+
+    async def send_event(self, event):
+        await self.send_events({'events': [event]})
+
+    async def send_events(self, event):
+        # A burst of events coalesced by attendify_drf.events.EventDispatcher
+        frames = [self.event_frame(item) for item in event['events']]
+        await self.buffer_frames([frame for frame in frames if frame is not None])
+
+    async def buffer_frames(self, frames):
+        if not frames:
+            return
+        if not self.batch_window:
+            for frame in frames:
+                await self.send(text_data=frame)
+            return
+        self.frame_buffer.extend(frames)
+        if len(self.frame_buffer) >= self.batch_size:
+            await self.flush_events()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_events_later())
+
+    async def flush_events_later(self):
+        await asyncio.sleep(self.batch_window)
+        self.flush_task = None
+        await self.flush_events()
+
+    async def flush_events(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        while self.frame_buffer:
+            frames = self.frame_buffer[:self.batch_size]
+            del self.frame_buffer[:self.batch_size]
+            # Frames are already JSON, so the array is assembled without re-encoding them
+            await self.send(text_data='[' + ','.join(frames) + ']')
@@ -0,0 +1,253 @@
+import json
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .cache import bump_version, get_version
+
+
+def face_index_settings():
+    options = {'DIMENSIONS': 512, 'IVF_LISTS': 0, 'IVF_PROBES': 8, 'IVF_MIN_SIZE': 10000, 'MATCH_THRESHOLD': 0.6}
+    options.update(getattr(settings, 'FACE_INDEX', {}))
+    return options
+
+
+def normalize(vectors):
+    """Scales each row of ``vectors`` to unit length, so dot products are cosine similarities."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class EmbeddingField(serializers.ListField):
+    """
+    A face embedding given as a list of floats, or as its JSON text in
+    multipart requests. Stored as unit-length float32 bytes.
+    """
+    child = serializers.FloatField()
+    default_error_messages = {
+        'dimensions': 'Expected an embedding of {dimensions} values.',
+        'zero': 'Embedding must not be a zero vector.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or (isinstance(data, list) and len(data) == 1 and isinstance(data[0], str)):
+            try:
+                data = json.loads(data if isinstance(data, str) else data[0])
+            except ValueError:
+                self.fail('not_a_list', input_type=type(data).__name__)
+        vector = np.asarray(super().to_internal_value(data), dtype=np.float32)
+        dimensions = face_index_settings()['DIMENSIONS']
+        if vector.shape != (dimensions,):
+            self.fail('dimensions', dimensions=dimensions)
+        if not np.isfinite(vector).all() or not np.linalg.norm(vector):
+            self.fail('zero')
+        return normalize(vector)[0].tobytes()
+
+    def to_representation(self, value):
+        return np.frombuffer(value, dtype=np.float32).tolist()
+
+
+class FaceIndex:
+    """
+    In-memory nearest-neighbour index over the ``embedding`` column of a model.
+
+    Embeddings are rows of one unit-normalised float32 matrix, so a search is a
+    single matrix product. With ``ivf_lists`` set, indexes of ``ivf_min_size``
+    or more rows are also clustered by spherical k-means and a search only
+    scores the ``ivf_probes`` clusters closest to the query.
+
+    Each process loads the index on first use and applies saves and deletes it
+    handles itself once they commit. Changes made by other processes are
+    announced through a cache version and fetched by ``updated_at`` before
+    the next search. The clusters are trained once the index reaches
+    ``ivf_min_size`` rows and again whenever it has doubled since.
+
+    ``match_threshold`` is the similarity above which two embeddings are
+    taken to be the same person when visits are identified server-side.
+    """
+    # Allowance for clock differences between servers and commit delays
+    sync_margin = timedelta(seconds=5)
+
+    def __init__(self, model, dimensions=512, ivf_lists=0, ivf_probes=8, ivf_min_size=10000, match_threshold=0.6):
+        self.model = model
+        self.dimensions = dimensions
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.ivf_min_size = ivf_min_size
+        self.match_threshold = match_threshold
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    @property
+    def namespace(self):
+        return f'face-index:{self.model}'
+
+    def get_model(self):
+        return apps.get_model(self.model)
+
+    def __len__(self):
+        return self._size if self._loaded else 0
+
+    def update(self, instance):
+        """Called from post_save: indexes the instance's embedding, or drops it if it has none."""
+        pk, embedding = instance.pk, instance.embedding
+        transaction.on_commit(lambda: self._apply(pk, embedding))
+
+    def remove(self, pk):
+        """Called from post_delete."""
+        transaction.on_commit(lambda: self._apply(pk, None))
+
+    def _apply(self, pk, embedding):
+        with self._lock:
+            if self._loaded:
+                self._put(pk, embedding)
+                self._train_if_grown()
+        bump_version(self.namespace)
+
+    def search(self, vectors, k=5, min_score=-1.0):
+        """
+        Returns, for each row of ``vectors``, up to ``k`` ``(pk, score)`` pairs
+        with a cosine similarity of at least ``min_score``, best first.
+        """
+        queries = normalize(vectors)
+        with self._lock:
+            self._refresh()
+            if not self._size:
+                return [[] for _ in queries]
+            if self._centroids is None:
+                scores = queries @ self._matrix[:self._size].T
+                return [self._top(np.arange(self._size), row, k, min_score) for row in scores]
+            results = []
+            centroid_scores = queries @ self._centroids.T
+            probes = min(self.ivf_probes, len(self._centroids))
+            for query, row in zip(queries, centroid_scores):
+                lists = np.argpartition(-row, probes - 1)[:probes]
+                candidates = np.flatnonzero(np.isin(self._lists[:self._size], lists))
+                results.append(self._top(candidates, self._matrix[candidates] @ query, k, min_score))
+            return results
+
+    def _top(self, rows, scores, k, min_score):
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores)
+        return [
+            (int(self._ids[rows[i]]), float(scores[i])) for i in order if scores[i] >= min_score
+        ]
+
+    def _refresh(self):
+        version = get_version(self.namespace)
+        if not self._loaded:
+            self._load(version)
+        elif version != self._version:
+            self._sync(version)
+
+    def _load(self, version):
+        started = timezone.now()
+        rows = self.get_model()._default_manager.exclude(embedding=None).values_list('pk', 'embedding')
+        ids, blobs = [], []
+        for pk, embedding in rows.iterator(chunk_size=5000):
+            ids.append(pk)
+            blobs.append(bytes(embedding))
+        self._ids = np.array(ids, dtype=np.int64)
+        self._matrix = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(-1, self.dimensions).copy()
+        self._size = len(ids)
+        self._rows = {pk: row for row, pk in enumerate(ids)}
+        self._centroids = None
+        self._trained_size = 0
+        self._lists = np.zeros(self._size, dtype=np.int32)
+        self._train_if_grown()
+        self._version = version
+        self._synced_at = started - self.sync_margin
+        self._loaded = True
+
+    def _sync(self, version):
+        started = timezone.now()
+        changed = self.get_model()._default_manager.filter(updated_at__gte=self._synced_at)
+        for pk, embedding in changed.values_list('pk', 'embedding').iterator():
+            self._put(pk, embedding)
+        self._train_if_grown()
+        self._version = version
+        self._synced_at = started - self.sync_margin
+
+    def _put(self, pk, embedding):
+        row = self._rows.get(pk)
+        if embedding is None:
+            if row is not None:
+                # Move the last row into the gap so the matrix stays dense
+                last = self._size - 1
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = self._ids[last]
+                self._lists[row] = self._lists[last]
+                self._rows[int(self._ids[row])] = row
+                del self._rows[pk]
+                self._size = last
+            return
+        vector = np.frombuffer(bytes(embedding), dtype=np.float32)
+        if row is None:
+            row = self._size
+            if row == len(self._matrix):
+                self._grow()
+            self._ids[row] = pk
+            self._rows[pk] = row
+            self._size += 1
+        self._matrix[row] = vector
+        if self._centroids is not None:
+            self._lists[row] = int(np.argmax(self._centroids @ vector))
+
+    def _grow(self):
+        capacity = max(1024, len(self._matrix) * 2)
+        for name in ('_matrix', '_ids', '_lists'):
+            array = getattr(self, name)
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            setattr(self, name, grown)
+
+    def _train_if_grown(self):
+        if self.ivf_lists and self._size >= max(self.ivf_min_size, 2 * self._trained_size):
+            self._train()
+
+    def _train(self, iterations=10):
+        rng = np.random.default_rng(0)
+        vectors = self._matrix[:self._size]
+        sample = vectors[rng.choice(self._size, size=min(self._size, self.ivf_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=self.ivf_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self._centroids = centroids.astype(np.float32)
+        self._trained_size = self._size
+        # Assigned in chunks to bound the size of the temporary score matrix
+        for start in range(0, self._size, 10000):
+            end = min(start + 10000, self._size)
+            self._lists[start:end] = np.argmax(vectors[start:end] @ self._centroids.T, axis=1)
+
+
+def face_index(model):
+    return FaceIndex(model, **{key.lower(): value for key, value in face_index_settings().items()})
+
+
+class FaceMatchSerializer(serializers.Serializer):
+    embedding = EmbeddingField()
+    k = serializers.IntegerField(min_value=1, max_value=100, default=5)
+    min_score = serializers.FloatField(min_value=-1, max_value=1, default=0.5)
+
+
+def match_faces(index, embedding, k=5, min_score=0.5):
+    """Top matches for one stored-format embedding, skipping rows deleted since they were indexed."""
+    matches = index.search(np.frombuffer(embedding, dtype=np.float32), k=k, min_score=min_score)[0]
+    existing = set(index.get_model()._default_manager.filter(pk__in=[pk for pk, _ in matches]).values_list('pk', flat=True))
+    for pk, _ in matches:
+        if pk not in existing:
+            index.remove(pk)
+    return [{'id': pk, 'score': score} for pk, score in matches if pk in existing]
@@ -0,0 +1,262 @@
+import asyncio
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+
+def serialize(obj):
+    # Serialize datetime objects to strings
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError("Type %s not serializable" % type(obj))
+
+
+TOPICS = ('event', 'employee', 'device', 'client')
+
+
+def topic_group(topic, value):
+    return f'{topic}.{value}'
+
+
+def subscriber_key(group):
+    return f'event-subscribers:{group}'
+
+
+class EventDispatcher:
+    """
+    Publishes realtime events to the channel layer from a background thread.
+
+    Events are queued only once the surrounding transaction commits, so
+    subscribers never hear about rows that were rolled back, and the request
+    thread never waits on Redis. The worker drains bursts of queued events and
+    sends each group its share of the burst as a single ``send_events`` message.
+
+    An event is addressed to the catch-all group and to one group per topic it
+    belongs to (see ``TOPICS``), but only groups that currently have
+    subscribers are sent to. Consumers register their channel in a Redis
+    sorted set per group through ``subscribe`` and ``unsubscribe``, and renew
+    it every few seconds, so subscribers that vanished without unsubscribing
+    expire after ``subscriber_ttl`` seconds. The worker reads a burst's groups
+    in one round trip; a group whose set is missing, e.g. after an eviction,
+    is sent to until its subscribers have registered again.
+    """
+
+    def __init__(self, group='broadcast', batch_window=0.01, max_batch_size=100, subscriber_ttl=60,
+                 cache_alias='default'):
+        self.group = group
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.subscriber_ttl = subscriber_ttl
+        self.cache_alias = cache_alias
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def send(self, event_name, data, immediately=False, **topics):
+        """
+        Queues an event once the surrounding transaction commits, or right
+        away with ``immediately``, for callers outside any transaction such as
+        background threads.
+        """
+        groups = [self.group, topic_group('event', event_name)]
+        for topic, values in topics.items():
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            groups.extend(topic_group(topic, value) for value in values)
+        self._send(event_name, data, dict.fromkeys(groups), immediately)
+
+    def send_bulk(self, event_name, items, **topics):
+        """
+        Announces a list of ``items`` as one event. Each topic maps to a list
+        of values aligned with ``items``, and the group of each value only
+        receives the items carrying that value.
+        """
+        slices = defaultdict(list)
+        for topic, values in topics.items():
+            for index, value in enumerate(values):
+                if value is not None:
+                    slices[topic_group(topic, value)].append(index)
+        every_item = tuple(range(len(items)))
+        groups = dict.fromkeys([self.group, topic_group('event', event_name)], every_item)
+        for group, indexes in slices.items():
+            groups[group] = tuple(indexes)
+        self._send(event_name, list(items), groups)
+
+    def _send(self, event_name, data, groups, immediately=False):
+        # Lets consumers subscribed to several matching topics drop the duplicate copies
+        event = (uuid.uuid4().hex, event_name, data, groups)
+        if immediately:
+            self._enqueue(event)
+        else:
+            transaction.on_commit(lambda: self._enqueue(event))
+
+    def redis(self):
+        # The raw client raises on errors, where the cache backend is configured to ignore them
+        return get_redis_connection(self.cache_alias)
+
+    def subscribe(self, channel_name, groups):
+        """
+        Registers ``channel_name`` as a subscriber of ``groups`` for the next
+        ``subscriber_ttl`` seconds; consumers call it again as a heartbeat.
+        """
+        now = time.time()
+        try:
+            pipe = self.redis().pipeline(transaction=False)
+            for group in groups:
+                key = subscriber_key(group)
+                # The placeholder keeps the key of a group everybody left, so an empty group is told
+                # apart from one whose key was evicted or flushed
+                pipe.zadd(key, {'': 0}, nx=True)
+                pipe.zadd(key, {channel_name: now + self.subscriber_ttl})
+                pipe.zremrangebyscore(key, 1, now)
+            pipe.execute()
+        except Exception:
+            logger.exception('Failed to register a subscriber of %d group(s)', len(groups))
+
+    def unsubscribe(self, channel_name, groups):
+        try:
+            pipe = self.redis().pipeline(transaction=False)
+            for group in groups:
+                pipe.zrem(subscriber_key(group), channel_name)
+            pipe.execute()
+        except Exception:
+            logger.exception('Failed to unregister a subscriber of %d group(s)', len(groups))
+
+    def subscribed(self, groups):
+        """
+        The groups among ``groups`` with a live subscriber, or whose
+        subscribers are unknown because their key is missing.
+        """
+        groups = list(groups)
+        now = time.time()
+        try:
+            pipe = self.redis().pipeline(transaction=False)
+            for group in groups:
+                pipe.exists(subscriber_key(group))
+                pipe.zcount(subscriber_key(group), now, '+inf')
+            results = pipe.execute()
+        except Exception:
+            # Better to send to empty groups than to drop events
+            logger.exception('Failed to read event subscribers')
+            return set(groups)
+        return {
+            group for group, exists, live in zip(groups, results[::2], results[1::2]) if not exists or live
+        }
+
+    def flush(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _enqueue(self, event):
+        self._ensure_worker()
+        self._queue.put(event)
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='event-dispatcher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        # A private event loop keeps the channel layer's connection pool alive between batches
+        loop = asyncio.new_event_loop()
+        while True:
+            events = self._next_batch()
+            try:
+                group_messages = self.group_messages(
+                    events, self.subscribed({group for *_, groups in events for group in groups}),
+                )
+                loop.run_until_complete(self._publish(group_messages))
+            except Exception:
+                logger.exception('Failed to publish %d realtime event(s)', len(events))
+            finally:
+                for _ in events:
+                    self._queue.task_done()
+
+    def _next_batch(self):
+        events = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(events) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                events.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    @staticmethod
+    def group_messages(events, subscribed):
+        """
+        Maps each subscribed group to the messages it receives for ``events``.
+
+        A plain event is a ``{'id', 'frame'}`` message with the final
+        WebSocket text. A bulk event is an ``{'id', 'event', 'indexes',
+        'items'}`` message with the group's slice of it, every item encoded
+        once; consumers in several groups assemble their frame from the items
+        they haven't delivered yet, so an item overlapping two slices reaches
+        each socket only once.
+        """
+        group_messages = defaultdict(list)
+        for event_id, event_name, data, groups in events:
+            messages, items = {}, {}
+            for group, indexes in groups.items():
+                if group not in subscribed:
+                    continue
+                if indexes not in messages:
+                    if indexes is None:
+                        messages[indexes] = {
+                            'id': event_id, 'frame': json.dumps({'event': event_name, 'data': data}, default=serialize),
+                        }
+                    else:
+                        for index in indexes:
+                            if index not in items:
+                                items[index] = json.dumps(data[index], default=serialize)
+                        messages[indexes] = {
+                            'id': event_id, 'event': event_name, 'indexes': list(indexes),
+                            'items': [items[index] for index in indexes],
+                        }
+                group_messages[group].append(messages[indexes])
+        return group_messages
+
+    async def _publish(self, group_messages):
+        channel_layer = get_channel_layer()
+        for group, messages in group_messages.items():
+            if len(messages) == 1:
+                await channel_layer.group_send(group, {'type': 'send_event', **messages[0]})
+            else:
+                await channel_layer.group_send(group, {'type': 'send_events', 'events': messages})
+
+
+dispatcher = EventDispatcher(**{key.lower(): value for key, value in getattr(settings, 'EVENT_DISPATCHER', {}).items()})
+atexit.register(dispatcher.flush)
+
+
+def send_group_event(event_name, data, **topics):
+    dispatcher.send(event_name, data, **topics)
+
+
+def publish_group_event(event_name, data, **topics):
+    """``send_group_event()`` without waiting for a commit, for code running outside transactions."""
+    dispatcher.send(event_name, data, immediately=True, **topics)
+
+
+def send_bulk_group_event(event_name, items, **topics):
+    dispatcher.send_bulk(event_name, items, **topics)
@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+
+class FilterSerializer(serializers.Serializer):
+    """
+    Validates query parameters and applies them to a queryset.
+
+    Subclasses declare their fields and map each one to an ORM lookup in ``lookups``.
+    """
+    lookups = {}
+
+    def filter_queryset(self, queryset):
+        return queryset.filter(**{self.lookups[field]: value for field, value in self.validated_data.items()})
@@ -0,0 +1,100 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from PIL import Image
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+
+class ImageWorker:
+    """
+    Runs CPU-bound image work (decoding, resizing, re-encoding) in a bounded
+    pool of worker processes, so request threads and their database
+    connections are never held up by the size of an uploaded image.
+
+    Workers are spawned rather than forked and set Django up themselves, so
+    jobs are plain module-level functions taking picklable arguments. At most
+    ``max_pending`` jobs are queued per process; beyond that jobs are dropped
+    with a warning, to be caught up by a backfill command. With
+    ``max_workers=0`` jobs run inline, which is handy in development.
+    """
+
+    def __init__(self, max_workers=2, max_pending=500):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, func, *args):
+        if not self.max_workers:
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Image job %s%r failed', func.__name__, args)
+            return
+        if not self._slots.acquire(blocking=False):
+            logger.warning('Image worker queue is full, dropping %s%r', func.__name__, args)
+            return
+        try:
+            try:
+                future = self._get_executor().submit(func, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed while decoding a huge image); start a fresh pool
+                self._reset_executor()
+                future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._done(future, func, args))
+
+    def _done(self, future, func, args):
+        self._slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Image job %s%r failed', func.__name__, args, exc_info=future.exception())
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup,
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_worker = ImageWorker(**{key.lower(): value for key, value in getattr(settings, 'IMAGE_WORKER', {}).items()})
+
+
+class ImageUploadField(serializers.FileField):
+    """
+    Accepts an uploaded image after reading only its header.
+
+    DRF's ``ImageField`` copies in-memory uploads and runs Pillow's ``verify()``
+    in the request thread; here the pixel data is first decoded by the
+    ``image_worker`` job that processes the upload after it is committed.
+    """
+    default_error_messages = serializers.ImageField.default_error_messages
+
+    def to_internal_value(self, data):
+        file_object = super().to_internal_value(data)
+        try:
+            image = Image.open(file_object)
+            file_object.content_type = Image.MIME.get(image.format)
+        except Exception as exc:
+            raise serializers.ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+        finally:
+            file_object.seek(0)
+        return file_object
@@ -0,0 +1,184 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from .events import publish_group_event
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('clients', 'employees')
+
+
+class LiveStats:
+    """
+    Occupancy and footfall counters kept in Redis as detections arrive, so
+    lobby displays read them in O(1) instead of aggregating visits and
+    attendances on every poll.
+
+    For each kind of person (``clients``, ``employees``):
+
+    * ``on_site`` counts the people detected within the last
+      ``presence_window`` seconds (a sorted set of id -> last detection);
+    * ``unique_today`` estimates the distinct people seen today with a
+      HyperLogLog, within about 1%;
+    * ``visits_today`` and ``visits_this_hour`` count detections per device.
+
+    Days and hours are in the local time zone. Detections are queued once
+    their transaction commits and counted by a background thread, which
+    writes a burst of them to Redis in one pipeline, so requests never wait on
+    Redis. A ``live_stats`` event with the new snapshot is pushed at most
+    every ``push_interval`` seconds.
+    """
+
+    def __init__(self, presence_window=900, retention_days=7, push_interval=1, cache_alias='default',
+                 batch_window=0.01, max_batch_size=100):
+        self.presence_window = presence_window
+        self.retention_days = retention_days
+        self.push_interval = push_interval
+        self.cache_alias = cache_alias
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._timer = None
+
+    @staticmethod
+    def key(*parts):
+        return ':'.join(('live-stats',) + tuple(str(part) for part in parts))
+
+    def redis(self):
+        return get_redis_connection(self.cache_alias)
+
+    def record(self, kind, detections):
+        """Counts ``(person_id, device_id, datetime)`` detections once the current transaction commits."""
+        detections = list(detections)
+        if detections:
+            transaction.on_commit(lambda: self._enqueue((kind, detections)))
+
+    def flush(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _enqueue(self, batch):
+        self._ensure_worker()
+        self._queue.put(batch)
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='live-stats', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batches = self._next_batch()
+            try:
+                self._record(batches)
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+    def _next_batch(self):
+        batches = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batches) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batches.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batches
+
+    def _record(self, batches):
+        """Counts the ``(kind, detections)`` batches in one pipeline."""
+        last_seen = defaultdict(dict)
+        expiries = {}
+        try:
+            pipe = self.redis().pipeline(transaction=False)
+            for kind, detections in batches:
+                for person_id, device_id, moment in detections:
+                    present = last_seen[kind]
+                    present[person_id] = max(present.get(person_id, 0), moment.timestamp())
+                    moment = timezone.localtime(moment)
+                    day, hour = f'{moment:%Y%m%d}', f'{moment:%Y%m%d%H}'
+                    pipe.pfadd(self.key(kind, 'unique', day), person_id)
+                    pipe.hincrby(self.key(kind, 'visits', day), device_id)
+                    pipe.hincrby(self.key(kind, 'visits', hour), device_id)
+                    expiries[self.key(kind, 'unique', day)] = self.retention_days * 86400
+                    expiries[self.key(kind, 'visits', day)] = self.retention_days * 86400
+                    expiries[self.key(kind, 'visits', hour)] = 2 * 86400
+            for kind, present in last_seen.items():
+                pipe.zadd(self.key(kind, 'present'), present, gt=True)
+                pipe.zremrangebyscore(self.key(kind, 'present'), '-inf', timezone.now().timestamp() - self.presence_window)
+            for key, timeout in expiries.items():
+                pipe.expire(key, timeout)
+            pipe.execute()
+        except Exception:
+            # Counters are best effort; the detections themselves are already stored
+            logger.exception('Failed to count %d live stats detection batch(es)', len(batches))
+            return
+        self._schedule_push()
+
+    def snapshot(self):
+        now = timezone.now()
+        local = timezone.localtime(now)
+        day, hour = f'{local:%Y%m%d}', f'{local:%Y%m%d%H}'
+        pipe = self.redis().pipeline(transaction=False)
+        for kind in KINDS:
+            pipe.zcount(self.key(kind, 'present'), now.timestamp() - self.presence_window, '+inf')
+            pipe.pfcount(self.key(kind, 'unique', day))
+            pipe.hgetall(self.key(kind, 'visits', day))
+            pipe.hgetall(self.key(kind, 'visits', hour))
+        results = iter(pipe.execute())
+        data = {'timestamp': now}
+        for kind in KINDS:
+            on_site, unique_today, visits_today, visits_this_hour = (next(results) for _ in range(4))
+            visits_today = {int(device): int(count) for device, count in visits_today.items()}
+            data[kind] = {
+                'on_site': on_site,
+                'unique_today': unique_today,
+                'visits_today': sum(visits_today.values()),
+                'visits_today_by_device': visits_today,
+                'visits_this_hour_by_device': {
+                    int(device): int(count) for device, count in visits_this_hour.items()
+                },
+            }
+        return data
+
+    def push(self):
+        try:
+            # Pushed from the stats thread or a timer, outside any transaction
+            publish_group_event('live_stats', self.snapshot())
+        except Exception:
+            logger.exception('Failed to push live stats')
+
+    def _schedule_push(self):
+        # Leading push for the first detection in an interval, trailing push for the rest of the burst
+        if cache.add(self.key('pushed'), 1, timeout=self.push_interval):
+            self.push()
+            return
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.push_interval, self._push_later)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _push_later(self):
+        with self._lock:
+            self._timer = None
+        self.push()
+
+
+live_stats = LiveStats(**{key.lower(): value for key, value in getattr(settings, 'LIVE_STATS', {}).items()})
@@ -0,0 +1,103 @@
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class DateTimeCursorPagination(CursorPagination):
+    """
+    Keyset pagination over event tables ordered by their ``datetime`` column.
+
+    Each page is a range scan on the ``datetime`` index starting from the
+    cursor position, so fetching a page deep into the table costs the same as
+    fetching the first one.
+
+    ``paginate_queryset()`` is DRF's, split in two around the query so that
+    ``apaginate_queryset()`` can fetch the page with the async ORM.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-datetime', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset()`` for async views."""
+        page_queryset = self.page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.set_page([item async for item in page_queryset])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The query of the requested page plus one row, telling whether another page follows."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            order = self.ordering[0]
+            is_reversed = order.startswith('-')
+            order_attr = order.lstrip('-')
+            # (cursor reversed) XOR (queryset reversed)
+            if self.cursor.reverse != is_reversed:
+                queryset = queryset.filter(**{order_attr + '__lt': current_position})
+            else:
+                queryset = queryset.filter(**{order_attr + '__gt': current_position})
+
+        return queryset[offset:offset + self.page_size + 1]
+
+    def set_page(self, results):
+        """Sets the page and the positions of its neighbours from the rows of ``page_queryset()``."""
+        offset, reverse, current_position = self.cursor if self.cursor is not None else (0, False, None)
+        self.page = results[:self.page_size]
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            # The query ran in reverse order, so the page is flipped back
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class DateCursorPagination(DateTimeCursorPagination):
+    """Keyset pagination for daily rollup tables ordered by their ``date`` column."""
+    ordering = ('-date', '-id')
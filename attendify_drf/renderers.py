@@ -1,7 +1,10 @@
 from http import HTTPStatus
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
 from datetime import datetime
 
+import orjson
+
 class ApiRenderer(JSONRenderer):
     def render(self, data, accepted_media_type=None, renderer_context=None):
         status_code = renderer_context['response'].status_code
@@ -24,4 +27,35 @@ class ApiRenderer(JSONRenderer):
                 "version": "1.0"
             }
         }
-        return super(ApiRenderer, self).render(response, accepted_media_type, renderer_context)
\ No newline at end of file
+        return super(ApiRenderer, self).render(response, accepted_media_type, renderer_context)
+
+
+class OrjsonApiRenderer(ApiRenderer):
+    """
+    Renders the same envelope as ``ApiRenderer`` with orjson.
+
+    Only the data is encoded; the envelope around it is assembled from
+    pre-encoded bytes. Types orjson doesn't know (lazy strings, Decimal,
+    timedelta, ...) are converted like DRF's encoder would. Requests for
+    indented output fall back to ``ApiRenderer``.
+    """
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    status_prefixes = {
+        status.value: b'{"status":' + orjson.dumps(status.phrase) + b',"code":' + str(status.value).encode()
+        for status in HTTPStatus
+    }
+    default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        status_code = renderer_context['response'].status_code
+        body = orjson.dumps(data, default=self.default, option=self.options)
+
+        # Handle error responses
+        if not str(status_code).startswith('2'):
+            return b''.join((self.status_prefixes[status_code], b',"errors":', body, b'}'))
+
+        # Handle success responses
+        metadata = b',"metadata":{"timestamp":"' + datetime.now().isoformat().encode() + b'","version":"1.0"}}'
+        return b''.join((self.status_prefixes[status_code], b',"data":', body, metadata))
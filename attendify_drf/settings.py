@@ -29,6 +29,7 @@ SYSTEM_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -44,6 +45,7 @@ LOCAL_APPS = [
     'users',
     'employees',
     'clients',
+    'sharedapp',
 ]
 
 INSTALLED_APPS = SYSTEM_APPS + THIRD_PARTY_APPS + LOCAL_APPS
@@ -89,6 +91,27 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Realtime events are published after commit by a background worker, which
+# coalesces events arriving within BATCH_WINDOW seconds into one group message.
+# WebSocket subscriptions are registered in Redis and expire SUBSCRIBER_TTL
+# seconds after the last heartbeat of their connection.
+EVENT_DISPATCHER = {
+    'GROUP': 'broadcast',
+    'BATCH_WINDOW': 0.01,
+    'MAX_BATCH_SIZE': 100,
+    'SUBSCRIBER_TTL': 60,
+}
+
+# Occupancy counts people detected within the last PRESENCE_WINDOW seconds; daily
+# footfall counters are kept for RETENTION_DAYS. Detections are counted by a background
+# thread; snapshots are pushed to WebSocket clients as live_stats events at most every
+# PUSH_INTERVAL seconds.
+LIVE_STATS = {
+    'PRESENCE_WINDOW': 900,
+    'RETENTION_DAYS': 7,
+    'PUSH_INTERVAL': 1,
+}
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -148,6 +171,20 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are stored once per distinct content and reference counted (see
+# sharedapp.models.ImageBlobModel); derived thumbnails use plain names.
+STORAGES = {
+    'default': {
+        'BACKEND': 'attendify_drf.storage.ContentAddressedStorage',
+    },
+    'thumbnails': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -159,8 +196,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # OrjsonApiRenderer renders the same envelope as ApiRenderer, faster; switch back
+    # to 'attendify_drf.renderers.ApiRenderer' to use DRF's stdlib JSON encoding
     'DEFAULT_RENDERER_CLASSES': (
-        'attendify_drf.renderers.ApiRenderer',
+        'attendify_drf.renderers.OrjsonApiRenderer',
     )
 }
 
@@ -187,9 +226,75 @@ CACHES = {
                               f'redis://{os.getenv("REDIS_HOST")}:{os.getenv("REDIS_PORT")}/1'),
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # Treat an unreachable Redis as a cache miss rather than failing the request
+            "IGNORE_EXCEPTIONS": True,
         }
     }
 }
 
+# Seconds a cached list/detail response is kept; writes invalidate it sooner
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Repeated detections of an employee on the same device within WINDOW seconds (by
+# detection datetime) are not stored again; with KEEP_BEST a higher score replaces
+# the stored record's score and image. A WINDOW of 0 disables deduplication.
+ATTENDANCE_DEDUP = {
+    'WINDOW': 30,
+    'KEEP_BEST': True,
+}
+
+# Image decoding and encoding runs in a pool of MAX_WORKERS processes per server
+# process, with at most MAX_PENDING queued jobs. MAX_WORKERS = 0 runs jobs inline.
+IMAGE_WORKER = {
+    'MAX_WORKERS': 2,
+    'MAX_PENDING': 500,
+}
+
+# Client sightings less than GAP seconds apart are merged into one visit session,
+# which is what visit_count counts; sessions are split after MAX_DURATION seconds.
+# A GAP of 0 makes every sighting its own visit.
+VISIT_SESSIONS = {
+    'GAP': 1800,
+    'MAX_DURATION': 12 * 3600,
+}
+
+# Client analytics buckets that ended CLOSE_DELAY seconds ago are cached for
+# CACHE_TIMEOUT seconds, or until a late visit, client change, sessionize_visits
+# or prune_events invalidates them; a report may span at most MAX_BUCKETS buckets.
+CLIENT_ANALYTICS = {
+    'CLOSE_DELAY': 300,
+    'CACHE_TIMEOUT': 30 * 86400,
+    'MAX_BUCKETS': 1000,
+}
+
+# Defaults of the prune_events command: attendances and client visits older than
+# DAYS are deleted BATCH_SIZE rows at a time, SLEEP seconds apart.
+EVENT_RETENTION = {
+    'DAYS': 365,
+    'BATCH_SIZE': 1000,
+    'SLEEP': 0.5,
+}
+
+# Face embeddings of clients and employees are searched in memory. DIMENSIONS must
+# match the camera software's embedding size. IVF_LISTS > 0 clusters indexes of at
+# least IVF_MIN_SIZE embeddings and only searches the IVF_PROBES nearest clusters,
+# trading a little recall for speed. Visits posted with an embedding are attached to
+# the best matching client scoring at least MATCH_THRESHOLD, or start a new client.
+FACE_INDEX = {
+    'DIMENSIONS': 512,
+    'IVF_LISTS': 0,
+    'IVF_PROBES': 8,
+    'IVF_MIN_SIZE': 10000,
+    'MATCH_THRESHOLD': 0.6,
+}
+
+# Thumbnails of uploaded images, generated once the upload is committed.
+# Serializers expose their URLs next to the original image.
+THUMBNAILS = {
+    'SIZE': (256, 256),
+    'FORMAT': 'WEBP',  # or 'JPEG'
+    'QUALITY': 80,
+}
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
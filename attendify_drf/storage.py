@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct upload once, named after the SHA-256 of its content.
+
+    ``employees/attendances/frame.jpg`` is saved as
+    ``employees/attendances/ab/cd/abcd….jpg``; uploading the same bytes again
+    returns the existing name without writing anything. Since several rows
+    may share a file, files are only deleted once nothing references them
+    (see ``sharedapp.models.ImageBlobModel``).
+    """
+
+    def __init__(self, **kwargs):
+        # Concurrent uploads of the same content write identical bytes to the same path
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return super().save(self.hashed_name(name, content), content, max_length=max_length)
+
+    @staticmethod
+    def hashed_name(name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest[2:4], digest + extension).replace('\\', '/')
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        from sharedapp.models import ImageBlobModel
+
+        # Serializes with the deletion of a file of the same content (see ImageBlobQuerySet.delete_files)
+        ImageBlobModel.objects.touch(name)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
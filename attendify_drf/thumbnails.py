@@ -0,0 +1,94 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, storages
+from django.db import transaction
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .images import image_worker
+
+THUMBNAIL_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def thumbnail_settings():
+    options = {'SIZE': (256, 256), 'FORMAT': 'WEBP', 'QUALITY': 80}
+    options.update(getattr(settings, 'THUMBNAILS', {}))
+    return options
+
+
+def thumbnail_name(name):
+    """``employees/attendances/face.jpg`` -> ``thumbnails/employees/attendances/face.webp``"""
+    root, _ = os.path.splitext(name)
+    return f'thumbnails/{root}.{THUMBNAIL_EXTENSIONS[thumbnail_settings()["FORMAT"]]}'
+
+
+def thumbnail_key(thumbnail):
+    return f'thumbnail-available:{thumbnail}'
+
+
+def thumbnail_available(thumbnail):
+    """Whether ``generate_thumbnail()`` has stored ``thumbnail``, without asking the storage."""
+    return bool(cache.get(thumbnail_key(thumbnail)))
+
+
+def generate_thumbnail(name, storage=default_storage):
+    """
+    Writes the thumbnail of the image stored as ``name`` unless it already
+    exists, and marks it available for ``ThumbnailField``.
+
+    JPEG sources are decoded at a reduced scale via ``draft()``, so a full-size
+    camera frame is never fully decompressed just to be shrunk.
+    """
+    options = thumbnail_settings()
+    thumbnail = thumbnail_name(name)
+    thumbnail_storage = storages['thumbnails']
+    if thumbnail_storage.exists(thumbnail):
+        cache.set(thumbnail_key(thumbnail), True, timeout=None)
+        return thumbnail
+    with storage.open(name) as source:
+        image = Image.open(source)
+        image.draft('RGB', options['SIZE'])
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(options['SIZE'])
+        if image.mode not in ('RGB', 'RGBA', 'L') or (image.mode == 'RGBA' and options['FORMAT'] == 'JPEG'):
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, format=options['FORMAT'], quality=options['QUALITY'])
+    thumbnail_storage.save(thumbnail, ContentFile(buffer.getvalue()))
+    cache.set(thumbnail_key(thumbnail), True, timeout=None)
+    return thumbnail
+
+
+def schedule_thumbnail(file):
+    """Queues the thumbnail of an image field's file on the image worker once the current transaction commits."""
+    if not file:
+        return
+    name = file.name
+    transaction.on_commit(lambda: image_worker.submit(generate_thumbnail, name))
+
+
+class ThumbnailField(serializers.ReadOnlyField):
+    """
+    Read-only URL of an image field's thumbnail, e.g. ``image_thumbnail = ThumbnailField(source='image')``.
+
+    Thumbnails are generated after commit, and a job dropped by a full worker
+    queue is only caught up by ``generate_thumbnails``, so the image's own URL
+    is returned until its thumbnail exists. Availability is read from the flag
+    ``generate_thumbnail()`` sets in the cache rather than from the storage,
+    which may cost a network round trip per row; if the flag is evicted, the
+    image's URL is returned until ``generate_thumbnails`` sets it again.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        thumbnail = thumbnail_name(value.name)
+        url = storages['thumbnails'].url(thumbnail) if thumbnail_available(thumbnail) else value.url
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
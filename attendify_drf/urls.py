@@ -28,6 +28,7 @@ urlpatterns = [
     path('users/', include('users.urls')),
     path('employees/', include('employees.urls')),
     path('clients/', include('clients.urls')),
+    path('stats/', include('sharedapp.urls')),
 ]
 
 # Serve static and media files during development
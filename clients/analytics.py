@@ -0,0 +1,146 @@
+"""
+Visitor breakdowns aggregated in the database.
+
+Each report groups the visits of a period by a time bucket (``date_trunc`` in
+the current time zone) and one dimension, counting visits and distinct
+clients. Buckets that ended more than ``CLOSE_DELAY`` seconds ago no longer
+change, so their rows are cached and only the open and uncached buckets are
+queried, in a single aggregated query.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import ExtractHour, Trunc
+from django.utils import timezone
+
+from attendify_drf.cache import get_version, invalidate_version
+
+from .models import ClientVisitHistoryModel, GenderChoices
+
+CACHE_NAMESPACE = 'client-analytics'
+INTERVALS = ('hour', 'day', 'week', 'month')
+# Lower edges of the visit_count histogram buckets, applied to the visit_number of each
+# session, so a closed bucket doesn't change when its clients come back
+VISIT_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+# Visits excluded from a report because their client's value is unknown
+UNKNOWN_DIMENSIONS = {
+    'gender': Q(client__gender=GenderChoices.UNKNOWN),
+    'age': Q(client__age__isnull=True),
+}
+
+
+def analytics_settings():
+    options = {'CLOSE_DELAY': 300, 'CACHE_TIMEOUT': 30 * 86400, 'MAX_BUCKETS': 1000}
+    options.update(getattr(settings, 'CLIENT_ANALYTICS', {}))
+    return options
+
+
+def invalidate_reports(report=None):
+    """Drops the cached buckets of every report, or only those of ``report``."""
+    invalidate_version(CACHE_NAMESPACE, report)
+
+
+def is_closed(moment):
+    """Whether ``moment`` falls in buckets that may already be cached."""
+    return moment <= timezone.now() - timedelta(seconds=analytics_settings()['CLOSE_DELAY'])
+
+
+def report_dimension(report, age_band=10):
+    """The grouping expression of ``report``, returned under the report's name."""
+    if report == 'gender':
+        return F('client__gender')
+    if report == 'age':
+        # Integer division, so 37 falls in the 30 band
+        return F('client__age') / Value(age_band) * Value(age_band)
+    if report == 'visit_count':
+        return Case(
+            *[When(visit_number__gte=edge, then=Value(edge)) for edge in reversed(VISIT_COUNT_BUCKETS)],
+            default=Value(0), output_field=IntegerField(),
+        )
+    if report == 'device':
+        return F('device_id')
+    if report == 'hour':
+        return ExtractHour('datetime')
+    raise ValueError(report)
+
+
+def bucket_start(moment, interval):
+    moment = timezone.localtime(moment).replace(tzinfo=None)
+    if interval == 'hour':
+        start = moment.replace(minute=0, second=0, microsecond=0)
+    else:
+        start = datetime.combine(moment.date(), datetime.min.time())
+        if interval == 'week':
+            start -= timedelta(days=start.weekday())
+        elif interval == 'month':
+            start = start.replace(day=1)
+    return timezone.make_aware(start)
+
+
+def next_bucket(start, interval):
+    start = timezone.localtime(start).replace(tzinfo=None)
+    if interval == 'hour':
+        start += timedelta(hours=1)
+    elif interval == 'day':
+        start += timedelta(days=1)
+    elif interval == 'week':
+        start += timedelta(weeks=1)
+    else:
+        start = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return timezone.make_aware(start)
+
+
+def bucket_range(datetime_from, datetime_to, interval):
+    """Starts of the buckets overlapping ``[datetime_from, datetime_to)``."""
+    buckets = []
+    start = bucket_start(datetime_from, interval)
+    while start < datetime_to:
+        buckets.append(start)
+        start = next_bucket(start, interval)
+    return buckets
+
+
+def visit_report(report, interval, datetime_from, datetime_to, device_id=None, age_band=10):
+    """
+    Rows of ``{'bucket', <report>, 'visits', 'clients'}`` for every bucket
+    overlapping the period, oldest first. Whole buckets are counted, so the
+    period is widened to bucket boundaries.
+    """
+    options = analytics_settings()
+    buckets = bucket_range(datetime_from, datetime_to, interval)
+    closed_before = timezone.now() - timedelta(seconds=options['CLOSE_DELAY'])
+    version = f'{get_version(CACHE_NAMESPACE)}.{get_version(CACHE_NAMESPACE, report)}'
+    keys = {
+        start: f'{CACHE_NAMESPACE}:{version}:{report}:{age_band}:{interval}:{device_id}:{start.isoformat()}'
+        for start in buckets
+    }
+    cached = cache.get_many(keys.values())
+    rows_by_bucket = {start: cached[key] for start, key in keys.items() if key in cached}
+
+    missing = [start for start in buckets if start not in rows_by_bucket]
+    if missing:
+        # The queried range may span cached buckets too; their rows are skipped
+        rows_by_bucket.update({start: [] for start in missing})
+        uncached = set(missing)
+        visits = ClientVisitHistoryModel.objects.filter(
+            datetime__gte=missing[0], datetime__lt=next_bucket(missing[-1], interval),
+        )
+        if device_id is not None:
+            visits = visits.filter(device_id=device_id)
+        if report in UNKNOWN_DIMENSIONS:
+            visits = visits.exclude(UNKNOWN_DIMENSIONS[report])
+        rows = visits.annotate(
+            bucket=Trunc('datetime', interval), **{report: report_dimension(report, age_band)},
+        ).values('bucket', report).annotate(
+            visits=Count('id'), clients=Count('client', distinct=True),
+        ).order_by('bucket', report)
+        for row in rows:
+            if row['bucket'] in uncached:
+                rows_by_bucket[row['bucket']].append(row)
+        cache.set_many({
+            keys[start]: rows_by_bucket[start] for start in missing if next_bucket(start, interval) <= closed_before
+        }, timeout=options['CACHE_TIMEOUT'])
+
+    return [row for start in buckets for row in rows_by_bucket[start]]
@@ -0,0 +1,3 @@
+from attendify_drf.embeddings import face_index
+
+client_face_index = face_index('clients.ClientModel')
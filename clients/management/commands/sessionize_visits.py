@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from attendify_drf.cache import invalidate_cached_responses
+from clients.analytics import invalidate_reports
+from clients.models import ClientModel, ClientVisitHistoryModel, visit_session_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Merge visit histories of the same client that are less than the session gap apart into visit sessions '
+        'and lower visit_count by the merged rows, e.g. for visits recorded before sessionization. '
+        'Safe to run again'
+    )
+
+    def add_arguments(self, parser):
+        options = visit_session_settings()
+        parser.add_argument('--gap', type=int, default=options['GAP'], help='Session gap in seconds')
+        parser.add_argument(
+            '--max-duration', type=int, default=options['MAX_DURATION'], help='Longest session in seconds',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, gap, max_duration, batch_size, **options):
+        if gap < 1 or max_duration < 1:
+            raise CommandError('--gap and --max-duration must be positive')
+        gap, max_duration = timedelta(seconds=gap), timedelta(seconds=max_duration)
+        clients = ClientModel.objects.filter(visit_histories__isnull=False).distinct().order_by('pk')
+        merged = sessionized = 0
+        for client_id in clients.values_list('pk', flat=True).iterator(chunk_size=batch_size):
+            count = self.sessionize(client_id, gap, max_duration)
+            merged += count
+            sessionized += bool(count)
+        if merged:
+            # Rows were merged with update() and raw deletes, which skip the signal handlers
+            invalidate_cached_responses('clients')
+            invalidate_reports()
+        self.stdout.write(self.style.SUCCESS(f'Merged {merged} visit histories of {sessionized} clients into sessions'))
+
+    def sessionize(self, client_id, gap, max_duration):
+        with transaction.atomic():
+            # Same lock as ClientVisitHistoryQuerySet.record_sighting, so new sightings wait for the merge
+            visit_count = ClientModel.objects.select_for_update().filter(pk=client_id).values_list(
+                'visit_count', flat=True,
+            ).first()
+            sessions, changed, merged = [], {}, []
+            for visit in ClientVisitHistoryModel.objects.filter(client_id=client_id).order_by('datetime', 'id'):
+                session = sessions[-1] if sessions else None
+                ended_at = max(session.ended_at, visit.ended_at) if session else None
+                if session and visit.datetime <= session.ended_at + gap and ended_at - session.datetime <= max_duration:
+                    session.ended_at = ended_at
+                    session.device_ids = sorted(set(session.device_ids) | set(visit.device_ids) | {visit.device_id})
+                    session.sighting_count += visit.sighting_count
+                    session.updated_at = timezone.now()
+                    changed[session.pk] = session
+                    merged.append(visit.pk)
+                else:
+                    sessions.append(visit)
+            if not merged:
+                return 0
+            # Renumbered back from the lowered visit_count, like migration 0008 numbered them
+            first_number = visit_count - len(merged) - len(sessions) + 1
+            for number, session in enumerate(sessions, start=max(first_number, 1)):
+                if session.visit_number != number:
+                    session.visit_number = number
+                    session.updated_at = timezone.now()
+                    changed[session.pk] = session
+            ClientVisitHistoryModel.objects.bulk_update(
+                changed.values(), ['ended_at', 'device_ids', 'sighting_count', 'visit_number', 'updated_at'],
+            )
+            # A raw delete skips per-row realtime events and cache invalidation for rows that were merged, not lost
+            duplicates = ClientVisitHistoryModel.objects.filter(pk__in=merged)
+            duplicates._raw_delete(duplicates.db)
+            ClientModel.objects.filter(pk=client_id).update(
+                visit_count=F('visit_count') - len(merged), updated_at=timezone.now(),
+            )
+        return len(merged)
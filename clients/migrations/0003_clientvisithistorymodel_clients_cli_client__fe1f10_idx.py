@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0002_clientvisithistorymodel_clientmodel_visit_history'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientvisithistorymodel',
+            index=models.Index(fields=['client', 'datetime'], name='clients_cli_client__fe1f10_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:00
+
+from django.db import migrations
+
+from sharedapp.partitions import partition_model
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0003_clientvisithistorymodel_clients_cli_client__fe1f10_idx'),
+    ]
+
+    operations = [
+        # The unused many-to-many table references visit history ids, which can't stay unique once partitioned
+        migrations.RemoveField(
+            model_name='clientmodel',
+            name='visit_history',
+        ),
+        # Rebuilds the table as monthly range partitions on datetime (PostgreSQL only, no model state change)
+        migrations.RunPython(partition_model('clients.ClientVisitHistoryModel'), migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0004_partition_clientvisithistorymodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientmodel',
+            name='embedding',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+    ]
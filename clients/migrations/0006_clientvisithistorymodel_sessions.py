@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:00
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def fill_sessions(apps, schema_editor):
+    # Every existing row starts out as a single-sighting session; sessionize_visits merges them
+    model = apps.get_model('clients', 'ClientVisitHistoryModel')
+    table = schema_editor.quote_name(model._meta.db_table)
+    schema_editor.execute(f'UPDATE {table} SET "ended_at" = "datetime", "device_ids" = ARRAY["device_id"]')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0005_clientmodel_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientvisithistorymodel',
+            name='ended_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='clientvisithistorymodel',
+            name='device_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='clientvisithistorymodel',
+            name='sighting_count',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.RunPython(fill_sessions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='clientvisithistorymodel',
+            name='ended_at',
+            field=models.DateTimeField(),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+def clear_unknown_ages(apps, schema_editor):
+    # Clients created by face identification without an estimate were stored with age 0
+    model = apps.get_model('clients', 'ClientModel')
+    model.objects.filter(age=0, gender='unknown').update(age=None)
+
+
+def restore_unknown_ages(apps, schema_editor):
+    model = apps.get_model('clients', 'ClientModel')
+    model.objects.filter(age__isnull=True).update(age=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0006_clientvisithistorymodel_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='clientmodel',
+            name='age',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(clear_unknown_ages, restore_unknown_ages),
+    ]
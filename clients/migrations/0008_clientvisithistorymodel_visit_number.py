@@ -0,0 +1,36 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+def number_visits(apps, schema_editor):
+    # Counted back from the client's visit_count, so the newest session gets it and older ones follow in order
+    visits = schema_editor.quote_name(apps.get_model('clients', 'ClientVisitHistoryModel')._meta.db_table)
+    clients = schema_editor.quote_name(apps.get_model('clients', 'ClientModel')._meta.db_table)
+    schema_editor.execute(f'''
+        UPDATE {visits} AS visit SET "visit_number" = numbered."visit_number"
+        FROM (
+            SELECT v."id", v."datetime", GREATEST(
+                c."visit_count" - COUNT(*) OVER (PARTITION BY v."client_id")
+                + ROW_NUMBER() OVER (PARTITION BY v."client_id" ORDER BY v."datetime", v."id"), 1
+            ) AS "visit_number"
+            FROM {visits} v JOIN {clients} c ON c."id" = v."client_id"
+        ) AS numbered
+        WHERE visit."id" = numbered."id" AND visit."datetime" = numbered."datetime"
+    ''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0007_alter_clientmodel_age'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientvisithistorymodel',
+            name='visit_number',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.RunPython(number_visits, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,14 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from attendify_drf.live_stats import live_stats
 from sharedapp.models import SharedModel
 
 
@@ -7,27 +17,144 @@ class GenderChoices(models.TextChoices):
     FEMALE = 'female'
     UNKNOWN = 'unknown'
 
+class ClientQuerySet(models.QuerySet):
+    # Clients embed only their newest visits; the full history is paged through /clients/<pk>/visit-history/
+    recent_visits_limit = 10
+
+    def with_recent_visits(self):
+        """Prefetches ``recent_visits`` for every client in one windowed query."""
+        return self.prefetch_related(models.Prefetch(
+            'visit_histories',
+            queryset=ClientVisitHistoryModel.objects.order_by('-datetime', '-id')[:self.recent_visits_limit],
+            to_attr='recent_visits',
+        ))
+
+
 class ClientModel(SharedModel):
     first_seen = models.DateTimeField(db_index=True)
     last_seen = models.DateTimeField(db_index=True)
     visit_count = models.IntegerField(default=1, db_index=True)
     gender = models.CharField(max_length=10, choices=GenderChoices)
-    age = models.IntegerField()
+    # Unknown until estimated; identified clients may be created without one
+    age = models.IntegerField(null=True, blank=True)
     image = models.ImageField(upload_to='clients/')
+    # Unit-length float32 face embedding, searched through clients.faces.client_face_index
+    embedding = models.BinaryField(null=True, blank=True, editable=False)
+
+    objects = ClientQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.first_seen} {self.last_seen} {self.visit_count}'
 
+    @cached_property
+    def recent_visits(self):
+        # Normally filled in by ClientQuerySet.with_recent_visits()
+        return list(self.visit_histories.order_by('-datetime', '-id')[:ClientQuerySet.recent_visits_limit])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values so post_save handlers can tell which fields changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: field.get_prep_value(getattr(self, field.attname)) for field in self._meta.concrete_fields
+        }
+
+    def get_changed_fields(self):
+        fields = [field for field in self._meta.concrete_fields if not field.primary_key]
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return [field.name for field in fields]
+        return [
+            field.name for field in fields
+            if field.attname in loaded_values
+            and field.get_prep_value(getattr(self, field.attname)) != loaded_values[field.attname]
+        ]
+
     class Meta:
         indexes = [
             models.Index(fields=['first_seen', 'last_seen', 'visit_count']),
         ]
 
 
+def visit_session_settings():
+    options = {'GAP': 1800, 'MAX_DURATION': 12 * 3600}
+    options.update(getattr(settings, 'VISIT_SESSIONS', {}))
+    return options
+
+
+class ClientVisitHistoryQuerySet(models.QuerySet):
+    def record_sighting(self, client_id, device_id, seen_at):
+        """
+        Folds a camera sighting into the client's visit session it falls within
+        ``VISIT_SESSIONS['GAP']`` seconds of, or starts a new session, which
+        counts as one more visit. Returns the session.
+        """
+        options = visit_session_settings()
+        gap, max_duration = timedelta(seconds=options['GAP']), timedelta(seconds=options['MAX_DURATION'])
+        with transaction.atomic():
+            # Locking the client serializes its sightings, so two of them can't both start a session
+            visit_count = ClientModel.objects.select_for_update().filter(pk=client_id).values_list(
+                'visit_count', flat=True,
+            ).first()
+            session = self.filter(
+                client_id=client_id,
+                # Bounded on both sides so only the partitions around seen_at are searched
+                datetime__gte=seen_at - max_duration,
+                datetime__lte=seen_at + gap,
+                ended_at__gte=seen_at - gap,
+                ended_at__lte=seen_at + max_duration,
+            ).order_by('-datetime').first() if options['GAP'] else None
+            if session is None:
+                session = self.create(
+                    client_id=client_id, device_id=device_id, datetime=seen_at, ended_at=seen_at, device_ids=[device_id],
+                    visit_number=(visit_count or 0) + 1,
+                )
+                client_update = {'visit_count': F('visit_count') + 1}
+            else:
+                update_fields = ['ended_at', 'device_ids', 'sighting_count', 'updated_at']
+                if seen_at < session.datetime:
+                    # Only saved when it moves, since that moves the visit between analytics buckets
+                    session.datetime = seen_at
+                    update_fields.append('datetime')
+                session.ended_at = max(session.ended_at, seen_at)
+                session.device_ids = sorted(set(session.device_ids) | {device_id})
+                session.sighting_count += 1
+                session.save(update_fields=update_fields)
+                client_update = {}
+            # Updated in the database so concurrent visits don't overwrite each other's counts
+            ClientModel.objects.filter(pk=client_id).update(
+                last_seen=Greatest('last_seen', seen_at), updated_at=timezone.now(), **client_update,
+            )
+            live_stats.record('clients', [(client_id, device_id, seen_at)])
+        return session
+
+
 class ClientVisitHistoryModel(SharedModel):
+    """
+    A visit session: the sightings of a client no more than ``VISIT_SESSIONS['GAP']``
+    seconds apart, from ``datetime`` to ``ended_at``. ``device_id`` is the
+    device of the first sighting, and ``visit_number`` the client's
+    ``visit_count`` once the session started.
+    """
     datetime = models.DateTimeField()
     device_id = models.IntegerField()
     client = models.ForeignKey(ClientModel, on_delete=models.CASCADE, related_name='visit_histories')
+    ended_at = models.DateTimeField()
+    device_ids = ArrayField(models.IntegerField(), default=list)
+    sighting_count = models.IntegerField(default=1)
+    visit_number = models.IntegerField(default=1)
+
+    objects = ClientVisitHistoryQuerySet.as_manager()
 
     def __str__(self):
-        return f'{self.datetime} {self.device_id} {self.client}'
\ No newline at end of file
+        return f'{self.datetime} {self.device_id} {self.client}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'datetime']),
+        ]
@@ -1,21 +1,124 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import ClientModel, ClientVisitHistoryModel
+
+from attendify_drf.embeddings import EmbeddingField, match_faces
+from attendify_drf.filters import FilterSerializer
+from attendify_drf.images import ImageUploadField
+from attendify_drf.thumbnails import ThumbnailField
+from .analytics import INTERVALS, analytics_settings, bucket_range
+from .faces import client_face_index
+from .models import ClientModel, ClientVisitHistoryModel, GenderChoices
 
 
 class ClientVisitHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ClientVisitHistoryModel
         fields = '__all__'
+        read_only_fields = ['ended_at', 'device_ids', 'sighting_count']
+
+    def create(self, validated_data):
+        # Posted sightings extend the client's current visit session or start a new one
+        return ClientVisitHistoryModel.objects.record_sighting(
+            validated_data['client'].id, validated_data['device_id'], validated_data['datetime'],
+        )
+
+
+class ClientVisitIdentifySerializer(serializers.Serializer):
+    """
+    A visit reported with the visitor's face embedding instead of a client id.
+    The visit goes to the most similar client scoring at least
+    ``FACE_INDEX['MATCH_THRESHOLD']``; otherwise a new client is created from
+    ``gender``, ``age`` and ``image``.
+    """
+    embedding = EmbeddingField(write_only=True)
+    device_id = serializers.IntegerField()
+    datetime = serializers.DateTimeField()
+    gender = serializers.ChoiceField(choices=GenderChoices.choices, default=GenderChoices.UNKNOWN, write_only=True)
+    age = serializers.IntegerField(default=None, allow_null=True, write_only=True)
+    image = ImageUploadField(required=False, write_only=True, help_text='Stored for new clients only')
 
     def create(self, validated_data):
-        visit_count = validated_data['client'].visit_count
-        validated_data['client'].visit_count = visit_count + 1
-        validated_data['client'].save()
-        return super().create(validated_data)
+        matches = match_faces(
+            client_face_index, validated_data['embedding'], k=1, min_score=client_face_index.match_threshold,
+        )
+        sighting = (validated_data['device_id'], validated_data['datetime'])
+        if matches:
+            visit_history = ClientVisitHistoryModel.objects.record_sighting(matches[0]['id'], *sighting)
+            visit_history.score = matches[0]['score']
+            visit_history.client_created = False
+            return visit_history
+        with transaction.atomic():
+            client = ClientModel.objects.create(
+                first_seen=validated_data['datetime'],
+                last_seen=validated_data['datetime'],
+                # Counted by the first visit session below
+                visit_count=0,
+                gender=validated_data['gender'],
+                age=validated_data['age'],
+                image=validated_data.get('image', ''),
+                embedding=validated_data['embedding'],
+            )
+            visit_history = ClientVisitHistoryModel.objects.record_sighting(client.id, *sighting)
+        visit_history.score = None
+        visit_history.client_created = True
+        return visit_history
+
+    def to_representation(self, instance):
+        data = ClientVisitHistorySerializer(instance).data
+        data['score'] = instance.score
+        data['client_created'] = instance.client_created
+        return data
+
 
 class ClientSerializer(serializers.ModelSerializer):
-    visit_histories = ClientVisitHistorySerializer(many=True, read_only=True)
+    visit_histories = ClientVisitHistorySerializer(source='recent_visits', many=True, read_only=True)
+    image = ImageUploadField()
+    image_thumbnail = ThumbnailField(source='image')
+    embedding = EmbeddingField(required=False, allow_null=True, write_only=True)
     class Meta:
         model = ClientModel
         fields = '__all__'
         read_only_fields = ['visit_count', 'visit_histories']
+
+
+class ClientVisitHistoryFilterSerializer(FilterSerializer):
+    client = serializers.IntegerField(required=False)
+    device_id = serializers.IntegerField(required=False)
+    datetime_from = serializers.DateTimeField(required=False, help_text='Inclusive lower bound')
+    datetime_to = serializers.DateTimeField(required=False, help_text='Exclusive upper bound')
+
+    lookups = {
+        'client': 'client_id',
+        'device_id': 'device_id',
+        'datetime_from': 'datetime__gte',
+        'datetime_to': 'datetime__lt',
+    }
+
+    def validate(self, data):
+        data = super().validate(data)
+        if 'datetime_from' in data and 'datetime_to' in data and data['datetime_from'] >= data['datetime_to']:
+            raise serializers.ValidationError('datetime_from must be earlier than datetime_to.')
+        return data
+
+
+class ClientAnalyticsSerializer(serializers.Serializer):
+    report = serializers.ChoiceField(choices=['gender', 'age', 'visit_count', 'device', 'hour'])
+    interval = serializers.ChoiceField(choices=INTERVALS, default='day', help_text='Time bucket size')
+    datetime_from = serializers.DateTimeField(required=False, help_text='Inclusive lower bound, default 30 days ago')
+    datetime_to = serializers.DateTimeField(required=False, help_text='Exclusive upper bound, default now')
+    device_id = serializers.IntegerField(required=False)
+    age_band = serializers.IntegerField(min_value=1, max_value=100, default=10, help_text='Width of age report bands')
+
+    def validate(self, data):
+        data = super().validate(data)
+        data.setdefault('datetime_to', timezone.now())
+        data.setdefault('datetime_from', data['datetime_to'] - timedelta(days=30))
+        if data['datetime_from'] >= data['datetime_to']:
+            raise serializers.ValidationError('datetime_from must be earlier than datetime_to.')
+        max_buckets = analytics_settings()['MAX_BUCKETS']
+        if len(bucket_range(data['datetime_from'], data['datetime_to'], data['interval'])) > max_buckets:
+            raise serializers.ValidationError(f'The period spans more than {max_buckets} {data["interval"]} buckets.')
+        return data
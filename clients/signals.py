@@ -1,65 +1,77 @@
 
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from attendify_drf.cache import invalidate_cached_responses
+from attendify_drf.events import send_group_event
+from attendify_drf.thumbnails import schedule_thumbnail
 
 from employees.models import EmployeeAttendanceModel
+from .analytics import invalidate_reports, is_closed
+from .faces import client_face_index
 from .models import ClientModel, ClientVisitHistoryModel
-from datetime import datetime
-import json
 
-def send_group_event(event_name, data):
-    # Serialize datetime objects to strings
-    def serialize(obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        raise TypeError("Type %s not serializable" % type(obj))
+CLIENT_EVENT_FIELDS = ('first_seen', 'last_seen', 'visit_count', 'gender', 'age', 'image')
+# Client fields whose changes regroup the cached visits of an analytics report
+CLIENT_REPORT_FIELDS = ('gender', 'age')
+
+
+def latest_visit_event_data(client_id):
+    # Only the newest visit is broadcast; subscribers page through /clients/<pk>/visit-history/ for the rest
+    return ClientVisitHistoryModel.objects.filter(client_id=client_id).order_by('-datetime').values(
+        'datetime', 'device_id'
+    ).first()
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'broadcast',
-        {
-            'type': 'send_event',
-            'event': event_name,
-            'data': json.loads(json.dumps(data, default=serialize)),  # Serialize data
-        }
-    )
 
 @receiver(post_save, sender=ClientModel)
-def client_update_handler(sender, instance, created, **kwargs):
+def client_update_handler(sender, instance, created, update_fields=None, **kwargs):
+    invalidate_cached_responses('clients')
+    schedule_thumbnail(instance.image)
     if created:
         event = 'client_create'
+        changed_fields = CLIENT_EVENT_FIELDS
+        if instance.embedding is not None:
+            client_face_index.update(instance)
     else:
         event = 'client_update'
-    data = {
-        'id': instance.id,
-        'first_seen': instance.first_seen,
-        'last_seen': instance.last_seen,
-        'visit_count': instance.visit_count,
-        'gender': instance.gender,
-        'age': instance.age,
-        'image': instance.image.url,
-        'visit_histories': [
-            {
-                'datetime': visit.datetime,
-                'device_id': visit.device_id
-            }
-            for visit in ClientVisitHistoryModel.objects.filter(client=instance).order_by('datetime')
-        ]
-    }
-    send_group_event(event, data)
+        changed_fields = update_fields or instance.get_changed_fields()
+        if 'embedding' in changed_fields:
+            client_face_index.update(instance)
+        for field in CLIENT_REPORT_FIELDS:
+            if field in changed_fields:
+                invalidate_reports(field)
+        changed_fields = [field for field in CLIENT_EVENT_FIELDS if field in changed_fields]
+    if not changed_fields:
+        return
+
+    data = {'id': instance.id}
+    for field in changed_fields:
+        value = getattr(instance, field)
+        data[field] = (value.url if value else None) if field == 'image' else value
+    if not created:
+        data['last_visit'] = latest_visit_event_data(instance.id)
+    send_group_event(event, data, client=instance.id)
 
 @receiver(post_delete, sender=ClientModel)
 def client_delete_handler(sender, instance, **kwargs):
+    invalidate_cached_responses('clients')
+    invalidate_reports()
+    client_face_index.remove(instance.id)
     data = {
         'id': instance.id
     }
-    send_group_event('client_delete', data)
+    send_group_event('client_delete', data, client=instance.id)
 
 
 @receiver(post_save, sender=ClientVisitHistoryModel)
-def client_visit_history_handler(sender, instance, created, **kwargs):
+def client_visit_history_handler(sender, instance, created, update_fields=None, **kwargs):
+    # Visits arrive with camera traffic, so only the client's detail and the client lists are invalidated
+    invalidate_cached_responses('clients', instance.client_id)
+    # Sightings extending a session leave its bucket alone, and new sessions usually fall in open buckets;
+    # other edits may have moved the visit out of a cached bucket
+    if update_fields is None and not created:
+        invalidate_reports()
+    elif (created or 'datetime' in update_fields) and is_closed(instance.datetime):
+        invalidate_reports()
     if created:
         event = 'client_visit_create'
     else:
@@ -67,16 +79,19 @@ def client_visit_history_handler(sender, instance, created, **kwargs):
     data = {
         'datetime': instance.datetime,
         'device_id': instance.device_id,
-        'client': instance.client.id
+        'client': instance.client_id
     }
-    send_group_event(event, data)
+    send_group_event(event, data, client=instance.client_id, device=instance.device_id)
 
 
 @receiver(post_delete, sender=ClientVisitHistoryModel)
 def client_visit_history_delete_handler(sender, instance, **kwargs):
+    invalidate_cached_responses('clients', instance.client_id)
+    if is_closed(instance.datetime):
+        invalidate_reports()
     data = {
         'datetime': instance.datetime,
         'device_id': instance.device_id,
-        'client': instance.client.id
+        'client': instance.client_id
     }
-    send_group_event('client_visit_delete', data)
\ No newline at end of file
+    send_group_event('client_visit_delete', data, client=instance.client_id, device=instance.device_id)
\ No newline at end of file
@@ -1,3 +1,288 @@
+import io
+import warnings
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from attendify_drf.cache import get_version
+from attendify_drf.embeddings import FaceIndex, normalize
+from attendify_drf.exports import streaming_export
+from .analytics import CACHE_NAMESPACE, visit_report
+from .models import ClientModel, ClientQuerySet, ClientVisitHistoryModel
+
+
+def create_client(**fields):
+    now = timezone.now()
+    return ClientModel.objects.create(**{
+        'first_seen': now, 'last_seen': now, 'gender': 'female', 'age': 30, 'image': '', **fields,
+    })
+
+
+class CachedClientResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice, self.bob = create_client(), create_client()
+
+    def visit_counts(self):
+        return {client['id']: client['visit_count'] for client in self.client.get('/clients/').json()['data']}
+
+    def detail(self, client):
+        return self.client.get(f'/clients/{client.id}/').json()['data']
+
+    def test_visits_invalidate_lists_and_their_client_detail_only(self):
+        self.assertEqual(self.visit_counts(), {self.alice.id: 1, self.bob.id: 1})
+        self.assertEqual(self.detail(self.alice)['visit_histories'], [])
+        bob = self.detail(self.bob)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ClientVisitHistoryModel.objects.record_sighting(self.alice.id, 3, timezone.now())
+
+        self.assertEqual(self.detail(self.alice)['visit_count'], 2)
+        self.assertEqual(len(self.detail(self.alice)['visit_histories']), 1)
+        self.assertEqual(self.visit_counts(), {self.alice.id: 2, self.bob.id: 1})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.detail(self.bob), bob)
+
+    def test_client_changes_invalidate_lists(self):
+        self.assertEqual(set(self.visit_counts()), {self.alice.id, self.bob.id})
+        self.detail(self.bob)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            carol = create_client(first_seen=timezone.now() - timedelta(days=1))
+            self.bob.delete()
+
+        self.assertEqual(set(self.visit_counts()), {self.alice.id, carol.id})
+        self.assertEqual(self.client.get(f'/clients/{self.bob.id}/').status_code, 404)
+
+    def test_sessionizing_visits_invalidates_client_responses(self):
+        now = timezone.now()
+        for minutes in (0, 10):
+            ClientVisitHistoryModel.objects.create(
+                client=self.alice, device_id=1, datetime=now - timedelta(minutes=minutes),
+                ended_at=now - timedelta(minutes=minutes), device_ids=[1],
+            )
+        self.alice.visit_count = 2
+        self.alice.save()
+        self.assertEqual(self.visit_counts()[self.alice.id], 2)
+        self.assertEqual(len(self.detail(self.alice)['visit_histories']), 2)
+
+        call_command('sessionize_visits', stdout=io.StringIO())
+        self.assertEqual(self.visit_counts()[self.alice.id], 1)
+        self.assertEqual(len(self.detail(self.alice)['visit_histories']), 1)
+
+    def test_pruning_visits_invalidates_client_responses(self):
+        ClientVisitHistoryModel.objects.create(
+            client=self.alice, device_id=1, datetime=timezone.now() - timedelta(days=400),
+            ended_at=timezone.now() - timedelta(days=400), device_ids=[1],
+        )
+        self.assertEqual(len(self.detail(self.alice)['visit_histories']), 1)
+        call_command('prune_events', sleep=0, stdout=io.StringIO())
+        self.assertEqual(self.detail(self.alice)['visit_histories'], [])
+
+
+class ClientListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def add_clients(self, count, visits):
+        now = timezone.now()
+        for _ in range(count):
+            client = create_client()
+            ClientVisitHistoryModel.objects.bulk_create([
+                ClientVisitHistoryModel(
+                    client=client, device_id=1, datetime=now - timedelta(minutes=minutes),
+                    ended_at=now - timedelta(minutes=minutes), device_ids=[1],
+                )
+                for minutes in range(visits)
+            ])
+
+    def list_clients(self):
+        cache.clear()
+        # One query for the clients and one for all of their recent visits, however many there are
+        with self.assertNumQueries(2):
+            return self.client.get('/clients/').json()['data']
+
+    def test_listing_clients_costs_two_queries(self):
+        self.add_clients(2, visits=3)
+        self.assertEqual([len(client['visit_histories']) for client in self.list_clients()], [3, 3])
+
+        self.add_clients(5, visits=ClientQuerySet.recent_visits_limit + 5)
+        clients = self.list_clients()
+        self.assertEqual(len(clients), 7)
+        self.assertEqual(
+            sorted(len(client['visit_histories']) for client in clients),
+            [3, 3] + [ClientQuerySet.recent_visits_limit] * 5,
+        )
+        for client in clients:
+            moments = [visit['datetime'] for visit in client['visit_histories']]
+            self.assertEqual(moments, sorted(moments, reverse=True))
+
+
+class ClientExportTests(TestCase):
+    def setUp(self):
+        self.clients = [create_client(age=age) for age in (20, 30, 40)]
+        self.expected = 'id,age\r\n' + ''.join(f'{client.id},{client.age}\r\n' for client in self.clients)
+
+    def export(self):
+        return streaming_export(ClientModel.objects.order_by('id'), ['id', 'age'], 'clients', chunk_size=2)
+
+    def test_served_synchronously(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertEqual(b''.join(self.export()).decode(), self.expected)
+
+    async def test_served_asynchronously(self):
+        with warnings.catch_warnings():
+            # Django warns when it has to collect a synchronous iterator for an async server
+            warnings.simplefilter('error')
+            self.assertEqual(b''.join([part async for part in self.export()]).decode(), self.expected)
+
+
+class FaceIndexTests(TestCase):
+    def setUp(self):
+        self.index = FaceIndex('clients.ClientModel', ivf_lists=4, ivf_probes=4, ivf_min_size=40)
+        self.rng = np.random.default_rng(0)
+
+    def embedding(self):
+        return normalize(self.rng.normal(size=512))[0].tobytes()
+
+    def save(self, embedding):
+        with self.captureOnCommitCallbacks(execute=True):
+            client = create_client(embedding=embedding)
+            self.index.update(client)
+        return client
+
+    def best_match(self, embedding):
+        matches = self.index.search(np.frombuffer(embedding, dtype=np.float32), k=1, min_score=0.99)[0]
+        return matches[0][0] if matches else None
+
+    def test_rolled_back_saves_are_not_indexed(self):
+        embedding = self.embedding()
+        self.assertIsNone(self.best_match(embedding))
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.index.update(create_client(embedding=embedding))
+                raise RuntimeError
+        self.assertIsNone(self.best_match(embedding))
+
+        client = self.save(embedding)
+        self.assertEqual(self.best_match(embedding), client.id)
+
+    def test_clusters_are_trained_once_the_index_grows_large_enough(self):
+        self.assertIsNone(self.best_match(self.embedding()))
+        clients = {self.save(embedding).id: embedding for embedding in [self.embedding() for _ in range(39)]}
+        self.assertIsNone(self.index._centroids)
+
+        client = self.save(self.embedding())
+        clients[client.id] = client.embedding
+        self.assertIsNotNone(self.index._centroids)
+        for pk, embedding in clients.items():
+            self.assertEqual(self.best_match(embedding), pk)
+
+
+class ClientAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+
+    def visit(self, client):
+        ClientVisitHistoryModel.objects.record_sighting(client.id, 1, self.now)
+
+    def report(self, report):
+        rows = visit_report(report, 'day', self.now - timedelta(hours=1), self.now, age_band=10)
+        return {row[report]: row['visits'] for row in rows}
+
+    def test_unknown_gender_and_age_are_left_out(self):
+        for fields in ({'gender': 'female', 'age': 34}, {'gender': 'male', 'age': 37}, {'gender': 'unknown', 'age': None}):
+            self.visit(create_client(**fields))
+
+        self.assertEqual(self.report('gender'), {'female': 1, 'male': 1})
+        self.assertEqual(self.report('age'), {30: 2})
+        self.assertEqual(self.report('device'), {1: 3})
+
+    def test_identified_clients_without_an_estimate_have_no_age(self):
+        embedding = normalize(np.random.default_rng(0).normal(size=512))[0].tolist()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/clients/visit-history/identify/', {
+                'embedding': embedding, 'device_id': 1, 'datetime': self.now.isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['data']['client_created'])
+        client = ClientModel.objects.get()
+        self.assertEqual((client.gender, client.age), ('unknown', None))
+        self.assertEqual(self.report('age'), {})
+
+
+class CachedClientAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        self.alice, self.bob = create_client(gender='female'), create_client(gender='male')
+
+    def visit(self, client, minutes):
+        with self.captureOnCommitCallbacks(execute=True):
+            ClientVisitHistoryModel.objects.record_sighting(client.id, 1, self.hour + timedelta(minutes=minutes))
+
+    def report(self, report='gender'):
+        rows = visit_report(report, 'hour', self.hour, self.hour + timedelta(hours=1))
+        return {row[report]: row['visits'] for row in rows}
+
+    def test_late_visits_reach_cached_buckets(self):
+        self.visit(self.alice, 0)
+        self.assertEqual(self.report(), {'female': 1})
+        self.visit(self.bob, 10)
+        self.assertEqual(self.report(), {'female': 1, 'male': 1})
+
+        # Extending a session leaves the cached buckets alone
+        version = get_version(CACHE_NAMESPACE)
+        self.visit(self.bob, 20)
+        self.assertEqual(get_version(CACHE_NAMESPACE), version)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.report(), {'female': 1, 'male': 1})
+
+    def test_returning_clients_leave_closed_visit_count_buckets_alone(self):
+        self.visit(self.alice, 0)
+        self.visit(self.bob, 0)
+        self.visit(self.bob, 40)
+        self.assertEqual(self.report('visit_count'), {2: 2, 3: 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ClientVisitHistoryModel.objects.record_sighting(self.alice.id, 1, timezone.now())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.report('visit_count'), {2: 2, 3: 1})
+        cache.clear()
+        self.assertEqual(self.report('visit_count'), {2: 2, 3: 1})
+
+    def test_client_changes_regroup_their_report_only(self):
+        self.visit(self.alice, 0)
+        self.assertEqual(self.report(), {'female': 1})
+        self.assertEqual(self.report('age'), {30: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.gender = 'male'
+            self.alice.save()
+        self.assertEqual(self.report(), {'male': 1})
+        with self.assertNumQueries(0):
+            self.report('age')
+
+    def test_maintenance_commands_invalidate_the_reports(self):
+        for minutes in (0, 10):
+            ClientVisitHistoryModel.objects.create(
+                client=self.alice, device_id=1, datetime=self.hour + timedelta(minutes=minutes),
+                ended_at=self.hour + timedelta(minutes=minutes), device_ids=[1],
+            )
+        self.assertEqual(self.report(), {'female': 2})
+        call_command('sessionize_visits', stdout=io.StringIO())
+        self.assertEqual(self.report(), {'female': 1})
 
-# Create your tests here.
+        ClientVisitHistoryModel.objects.update(datetime=self.hour - timedelta(days=400))
+        self.assertEqual(self.report(), {'female': 1})
+        call_command('prune_events', sleep=0, stdout=io.StringIO())
+        self.assertEqual(self.report(), {})
@@ -1,9 +1,18 @@
 from django.urls import path
-from .views import ClientView, ClientDetailView, ClientVisitHistoryView, ClientVisitHistoryDetailView
+from .views import (
+    ClientView, ClientExportView, ClientAnalyticsView, ClientMatchView, ClientDetailView, ClientDetailVisitHistoryView, ClientVisitHistoryView,
+    ClientVisitIdentifyView, ClientVisitHistoryExportView, ClientVisitHistoryDetailView,
+)
 
 urlpatterns = [
     path('', ClientView.as_view(), name='clients'),
+    path('export/', ClientExportView.as_view(), name='client_export'),
+    path('analytics/', ClientAnalyticsView.as_view(), name='client_analytics'),
+    path('match/', ClientMatchView.as_view(), name='client_match'),
     path('<int:pk>/', ClientDetailView.as_view(), name='client_detail'),
+    path('<int:pk>/visit-history/', ClientDetailVisitHistoryView.as_view(), name='client_visit_history'),
     path('visit-history/', ClientVisitHistoryView.as_view(), name='visit_history'),
+    path('visit-history/identify/', ClientVisitIdentifyView.as_view(), name='visit_history_identify'),
+    path('visit-history/export/', ClientVisitHistoryExportView.as_view(), name='visit_history_export'),
     path('visit-history/<int:pk>/', ClientVisitHistoryDetailView.as_view(), name='visit_history_detail'),
 ]
\ No newline at end of file
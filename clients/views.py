@@ -1,3 +1,4 @@
+from adrf.views import APIView as AsyncAPIView
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
@@ -6,11 +7,21 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from attendify_drf.async_views import asave
+from attendify_drf.cache import cached_response
+from attendify_drf.embeddings import FaceMatchSerializer, match_faces
+from attendify_drf.exports import ExportFormatSerializer, file_url, streaming_export
+from attendify_drf.pagination import DateTimeCursorPagination
+from .analytics import visit_report
+from .faces import client_face_index
 from .models import ClientModel, ClientVisitHistoryModel
-from .serializers import ClientSerializer, ClientVisitHistorySerializer
+from .serializers import (
+    ClientSerializer, ClientVisitHistorySerializer, ClientVisitHistoryFilterSerializer, ClientVisitIdentifySerializer,
+    ClientAnalyticsSerializer,
+)
 
 
-class ClientView(APIView):
+class ClientView(AsyncAPIView):
     serializer_class = ClientSerializer
     parser_classes = [MultiPartParser, FormParser]
 
@@ -20,21 +31,21 @@ class ClientView(APIView):
         operation_description='Create a new client with the provided details',
         responses={201: 'Client created', 400: 'Bad Request'}
     )
-    def post(self, request):
+    async def post(self, request):
         serializer = self.serializer_class(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
+        if await asave(serializer):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @swagger_auto_schema(
         operation_summary='Get all clients',
-        operation_description='Get all clients',
+        operation_description='Get all clients with their most recent visits',
         responses={200: ClientSerializer(many=True)}
     )
-    def get(self, request):
+    @cached_response('clients')
+    async def get(self, request):
         try:
-            clients = ClientModel.objects.all()
+            clients = [client async for client in ClientModel.objects.with_recent_visits().defer('embedding')]
             serializer = ClientSerializer(clients, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ClientModel.DoesNotExist:
@@ -43,17 +54,73 @@ class ClientView(APIView):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ClientDetailView(APIView):
+class ClientExportView(APIView):
+    fields = ['id', 'first_seen', 'last_seen', 'visit_count', 'gender', 'age', 'image']
+
+    @swagger_auto_schema(
+        operation_summary='Export clients',
+        operation_description='Stream every client as CSV or NDJSON',
+        query_serializer=ExportFormatSerializer,
+        responses={200: 'Client export'}
+    )
+    def get(self, request):
+        export = ExportFormatSerializer(data=request.query_params)
+        if not export.is_valid():
+            return Response(export.errors, status=status.HTTP_400_BAD_REQUEST)
+        return streaming_export(
+            ClientModel.objects.order_by('id'), self.fields, 'clients',
+            export.validated_data['export_format'], converters={'image': file_url},
+        )
+
+
+class ClientAnalyticsView(APIView):
+    @swagger_auto_schema(
+        operation_summary='Get visitor analytics',
+        operation_description=(
+            'Count visits and distinct clients per time bucket, broken down by gender, age band, '
+            'visit_count bucket (the client\'s visit count as of each visit), device or hour of day'
+        ),
+        query_serializer=ClientAnalyticsSerializer,
+        responses={200: 'Rows of bucket, report value, visits and clients', 400: 'Bad Request'}
+    )
+    def get(self, request):
+        params = ClientAnalyticsSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(visit_report(**params.validated_data), status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ClientMatchView(APIView):
+    serializer_class = FaceMatchSerializer
+
+    @swagger_auto_schema(
+        request_body=serializer_class,
+        operation_summary='Match a face embedding against clients',
+        operation_description='Get the clients whose face embeddings are most similar to the given one, best first',
+        responses={200: 'Client ids with cosine similarity scores', 400: 'Bad Request'}
+    )
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(match_faces(client_face_index, **serializer.validated_data), status=status.HTTP_200_OK)
+
+
+class ClientDetailView(AsyncAPIView):
     serializer_class = ClientSerializer
 
     @swagger_auto_schema(
         operation_summary='Get a client',
-        operation_description='Get a client by ID',
+        operation_description='Get a client by ID with their most recent visits',
         responses={200: ClientSerializer}
     )
-    def get(self, request, pk):
+    @cached_response('clients')
+    async def get(self, request, pk):
         try:
-            client = ClientModel.objects.get(pk=pk)
+            client = await ClientModel.objects.with_recent_visits().aget(pk=pk)
             serializer = ClientSerializer(client)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ClientModel.DoesNotExist:
@@ -66,12 +133,11 @@ class ClientDetailView(APIView):
         operation_description='Update a client by ID',
         responses={200: ClientSerializer}
     )
-    def put(self, request, pk):
+    async def put(self, request, pk):
         try:
-            client = ClientModel.objects.get(pk=pk)
+            client = await ClientModel.objects.with_recent_visits().aget(pk=pk)
             serializer = ClientSerializer(client, data=request.data)
-            if serializer.is_valid():
-                serializer.save()
+            if await asave(serializer):
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except ClientModel.DoesNotExist:
@@ -84,10 +150,10 @@ class ClientDetailView(APIView):
         operation_description='Delete a client by ID',
         responses={204: 'Client deleted'}
     )
-    def delete(self, request, pk):
+    async def delete(self, request, pk):
         try:
-            client = ClientModel.objects.get(pk=pk)
-            client.delete()
+            client = await ClientModel.objects.aget(pk=pk)
+            await client.adelete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except ClientModel.DoesNotExist:
             return Response({'detail': 'Client not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -95,7 +161,29 @@ class ClientDetailView(APIView):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ClientVisitHistoryView(APIView):
+class ClientDetailVisitHistoryView(AsyncAPIView):
+    serializer_class = ClientVisitHistorySerializer
+    pagination_class = DateTimeCursorPagination
+
+    @swagger_auto_schema(
+        operation_summary="Get a client's visit history",
+        operation_description="Get a client's visit histories, newest first, one cursor page at a time",
+        responses={200: ClientVisitHistorySerializer(many=True)}
+    )
+    async def get(self, request, pk):
+        try:
+            if not await ClientModel.objects.filter(pk=pk).aexists():
+                return Response({'detail': 'Client not found'}, status=status.HTTP_404_NOT_FOUND)
+            visit_histories = ClientVisitHistoryModel.objects.filter(client_id=pk)
+            paginator = self.pagination_class()
+            page = await paginator.apaginate_queryset(visit_histories, request, view=self)
+            serializer = ClientVisitHistorySerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ClientVisitHistoryView(AsyncAPIView):
     serializer_class = ClientVisitHistorySerializer
 
     @swagger_auto_schema(
@@ -104,13 +192,9 @@ class ClientVisitHistoryView(APIView):
         operation_description='Add a visit history for a client',
         responses={201: 'Visit history added', 400: 'Bad Request'}
     )
-    def post(self, request):
+    async def post(self, request):
         serializer = self.serializer_class(data=request.data)
-        if serializer.is_valid():
-            visit_count = serializer.validated_data['client'].visit_count
-            serializer.validated_data['client'].visit_count = visit_count + 1
-            serializer.validated_data['client'].save()
-            serializer.save()
+        if await asave(serializer):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -119,9 +203,9 @@ class ClientVisitHistoryView(APIView):
         operation_description='Get all visit histories',
         responses={200: ClientVisitHistorySerializer(many=True)}
     )
-    def get(self, request):
+    async def get(self, request):
         try:
-            visit_histories = ClientVisitHistoryModel.objects.all()
+            visit_histories = [visit_history async for visit_history in ClientVisitHistoryModel.objects.all()]
             serializer = ClientVisitHistorySerializer(visit_histories, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ClientVisitHistoryModel.DoesNotExist:
@@ -130,6 +214,50 @@ class ClientVisitHistoryView(APIView):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ClientVisitIdentifyView(AsyncAPIView):
+    serializer_class = ClientVisitIdentifySerializer
+
+    @swagger_auto_schema(
+        request_body=serializer_class,
+        operation_summary='Add a visit history by face embedding',
+        operation_description=(
+            'Add a visit history for the client matching the given face embedding, '
+            'creating a new client if none matches'
+        ),
+        responses={201: 'Visit history added', 400: 'Bad Request'}
+    )
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if await asave(serializer):
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ClientVisitHistoryExportView(APIView):
+    fields = ['id', 'client', 'device_id', 'datetime', 'ended_at', 'sighting_count']
+
+    @swagger_auto_schema(
+        operation_summary='Export visit histories',
+        operation_description='Stream every matching visit history, oldest first, as CSV or NDJSON',
+        query_serializer=ClientVisitHistoryFilterSerializer,
+        manual_parameters=[
+            openapi.Parameter('export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['csv', 'ndjson']),
+        ],
+        responses={200: 'Visit history export'}
+    )
+    def get(self, request):
+        export = ExportFormatSerializer(data=request.query_params)
+        filters = ClientVisitHistoryFilterSerializer(data=request.query_params)
+        if not export.is_valid():
+            return Response(export.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+        visit_histories = filters.filter_queryset(ClientVisitHistoryModel.objects.order_by('datetime', 'id'))
+        return streaming_export(
+            visit_histories, self.fields, 'visit_histories', export.validated_data['export_format'],
+        )
+
+
 class ClientVisitHistoryDetailView(APIView):
     serializer_class = ClientVisitHistorySerializer
 
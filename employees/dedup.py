@@ -0,0 +1,116 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmployeeAttendanceModel, EmployeeDailyAttendanceModel
+
+
+class AttendanceDeduplicator:
+    """
+    Suppresses repeated detections of the same employee on the same device.
+
+    The first detection opens a ``window`` second window, measured on the
+    detections' own ``datetime`` so that a device's backlog uploaded at once
+    keeps its clock-in and clock-out apart. The latest window of each employee
+    and device is kept in the cache. Later detections within ``window``
+    seconds of its start never reach the database unless ``keep_best`` is set
+    and they score higher than the stored record, in which case they replace
+    its score and image.
+    """
+
+    def __init__(self, window=30, keep_best=True):
+        self.window = window
+        self.keep_best = keep_best
+
+    @staticmethod
+    def key(employee_id, device_id):
+        return f'attendance-dedup:{employee_id}:{device_id}'
+
+    def in_window(self, entry, moment):
+        return entry.get('datetime') is not None and abs((moment - entry['datetime']).total_seconds()) <= self.window
+
+    def collapse(self, items):
+        """
+        Deduplicates a batch of detection dicts in memory, oldest first. Returns
+        the first detection of each window, with the best score and image of
+        the window if ``keep_best`` is set.
+        """
+        if not self.window:
+            return list(items)
+        windows = {}
+        kept = []
+        for item in sorted(items, key=lambda item: item['datetime']):
+            key = (item['employee_id'], item['device_id'])
+            first = windows.get(key)
+            if first is not None and self.in_window(first, item['datetime']):
+                if self.keep_best and item['score'] > first['score']:
+                    first.update(score=item['score'], image=item['image'])
+                continue
+            windows[key] = first = dict(item)
+            kept.append(first)
+        return kept
+
+    def claim(self, employee_id, device_id, moment):
+        """
+        Returns ``None`` if the detection at ``moment`` opens a new window and should be stored,
+        otherwise the ``{'id', 'score', 'datetime', 'expires'}`` entry of the window it falls in.
+        """
+        if not self.window:
+            return None
+        key = self.key(employee_id, device_id)
+        entry = {'id': None, 'score': None, 'datetime': moment, 'expires': time.time() + self.window}
+        if cache.add(key, entry, timeout=self.window):
+            return None
+        current = cache.get(key)
+        if current is not None and self.in_window(current, moment):
+            return current
+        # Outside the cached window; a late detection from a backlog doesn't displace a newer window
+        if current is None or current.get('datetime') is None or moment > current['datetime']:
+            cache.set(key, entry, timeout=self.window)
+        return None
+
+    def release(self, employee_id, device_id, moment):
+        if not self.window:
+            return
+        entry = cache.get(self.key(employee_id, device_id))
+        if entry is not None and entry['id'] is None and entry.get('datetime') == moment:
+            cache.delete(self.key(employee_id, device_id))
+
+    def remember(self, attendance, expires=None):
+        if not self.window:
+            return
+        current = cache.get(self.key(attendance.employee_id, attendance.device_id))
+        if current is not None and current.get('datetime') is not None and current['datetime'] > attendance.datetime:
+            return
+        expires = expires or time.time() + self.window
+        timeout = max(expires - time.time(), 1)
+        cache.set(self.key(attendance.employee_id, attendance.device_id), {
+            'id': attendance.id, 'score': attendance.score, 'datetime': attendance.datetime, 'expires': expires,
+        }, timeout=timeout)
+
+    def replace_if_better(self, entry, score, image):
+        """Moves a higher-scoring duplicate's score and image onto the stored record of its window."""
+        if not self.keep_best or entry['id'] is None or score <= entry['score']:
+            return None
+        with transaction.atomic():
+            attendance = EmployeeAttendanceModel.objects.select_for_update().filter(pk=entry['id']).first()
+            if attendance is None or score <= attendance.score:
+                return None
+            attendance.score = score
+            attendance.image = image
+            attendance.save(update_fields=['score', 'image', 'updated_at'])
+            EmployeeDailyAttendanceModel.objects.upsert(
+                attendance.employee_id, timezone.localdate(attendance.datetime),
+                first_seen=attendance.datetime, last_seen=attendance.datetime, detection_count=0,
+                device_ids=[attendance.device_id], best_score=score,
+            )
+        self.remember(attendance, expires=entry['expires'])
+        return attendance
+
+
+deduplicator = AttendanceDeduplicator(
+    **{key.lower(): value for key, value in getattr(settings, 'ATTENDANCE_DEDUP', {}).items()}
+)
@@ -0,0 +1,3 @@
+from attendify_drf.embeddings import face_index
+
+employee_face_index = face_index('employees.EmployeeModel')
@@ -0,0 +1,48 @@
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from employees.models import EmployeeAttendanceModel, EmployeeDailyAttendanceModel
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily attendance summaries from raw attendances, e.g. to backfill existing data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, date_from=None, date_to=None, batch_size=1000, **options):
+        attendances = EmployeeAttendanceModel.objects.all()
+        if date_from:
+            attendances = attendances.filter(datetime__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+        if date_to:
+            attendances = attendances.filter(
+                datetime__lt=timezone.make_aware(datetime.combine(date_to, time.min)) + timedelta(days=1)
+            )
+        summaries = attendances.annotate(date=TruncDate('datetime')).values('employee_id', 'date').annotate(
+            **EmployeeDailyAttendanceModel.objects.summary_aggregates()
+        ).order_by('employee_id', 'date')
+
+        batch = []
+        total = 0
+        for summary in summaries.iterator(chunk_size=batch_size):
+            batch.append(EmployeeDailyAttendanceModel(**summary))
+            if len(batch) >= batch_size:
+                total += self.save(batch)
+                batch = []
+        if batch:
+            total += self.save(batch)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} daily attendance summaries'))
+
+    def save(self, batch):
+        EmployeeDailyAttendanceModel.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['employee', 'date'],
+            update_fields=['first_seen', 'last_seen', 'detection_count', 'device_ids', 'best_score', 'updated_at'],
+        )
+        return len(batch)
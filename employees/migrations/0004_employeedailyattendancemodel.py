@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:45
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0003_employeemodel_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeDailyAttendanceModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField(db_index=True)),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+                ('detection_count', models.IntegerField(default=0)),
+                ('device_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('best_score', models.FloatField()),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_attendances', to='employees.employeemodel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('employee', 'date'), name='unique_employee_daily_attendance')],
+            },
+        ),
+    ]
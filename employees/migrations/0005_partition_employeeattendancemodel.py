@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:00
+
+from django.db import migrations
+
+from sharedapp.partitions import partition_model
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0004_employeedailyattendancemodel'),
+    ]
+
+    operations = [
+        # Rebuilds the table as monthly range partitions on datetime (PostgreSQL only, no model state change)
+        migrations.RunPython(partition_model('employees.EmployeeAttendanceModel'), migrations.RunPython.noop),
+    ]
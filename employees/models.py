@@ -1,5 +1,13 @@
+from datetime import datetime, time, timedelta
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Func, Max, Min, Value
+from django.db.models.functions import Cast, Greatest, Least
+from django.utils import timezone
+
 from sharedapp.models import SharedModel
-from django.db import models
 
 class EmployeeModel(SharedModel):
     first_name = models.CharField(max_length=255, blank=False, null=False, default='', db_index=True)
@@ -7,6 +15,8 @@ class EmployeeModel(SharedModel):
     email = models.EmailField(unique=True, blank=False, null=False)
     image = models.ImageField(upload_to='employees/', blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=False, null=False, unique=True)
+    # Unit-length float32 face embedding, searched through employees.faces.employee_face_index
+    embedding = models.BinaryField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
@@ -30,4 +40,100 @@ class EmployeeAttendanceModel(SharedModel):
     class Meta:
         indexes = [
             models.Index(fields=['datetime', 'employee']),
-        ]
\ No newline at end of file
+        ]
+
+
+class ArrayUnion(Func):
+    """Sorted, de-duplicated union of two integer arrays."""
+    template = 'ARRAY(SELECT DISTINCT UNNEST(%(expressions)s) ORDER BY 1)'
+    arg_joiner = ' || '
+    output_field = ArrayField(models.IntegerField())
+
+
+class EmployeeDailyAttendanceQuerySet(models.QuerySet):
+    def record_attendances(self, attendances):
+        """Folds new attendances into their employee's daily rows, with one upsert per employee and day."""
+        days = {}
+        for attendance in attendances:
+            key = (attendance.employee_id, timezone.localdate(attendance.datetime))
+            day = days.setdefault(key, {
+                'first_seen': attendance.datetime,
+                'last_seen': attendance.datetime,
+                'detection_count': 0,
+                'device_ids': set(),
+                'best_score': attendance.score,
+            })
+            day['first_seen'] = min(day['first_seen'], attendance.datetime)
+            day['last_seen'] = max(day['last_seen'], attendance.datetime)
+            day['detection_count'] += 1
+            day['device_ids'].add(attendance.device_id)
+            day['best_score'] = max(day['best_score'], attendance.score)
+        # Rows are locked in key order, so concurrent batches sharing employees can't deadlock
+        for (employee_id, date), day in sorted(days.items()):
+            day['device_ids'] = sorted(day['device_ids'])
+            self.upsert(employee_id, date, **day)
+
+    def upsert(self, employee_id, date, first_seen, last_seen, detection_count, device_ids, best_score):
+        # Merge in the database so concurrent ingests for the same day don't overwrite each other
+        merge = {
+            'first_seen': Least('first_seen', Value(first_seen)),
+            'last_seen': Greatest('last_seen', Value(last_seen)),
+            'detection_count': F('detection_count') + detection_count,
+            'device_ids': ArrayUnion('device_ids', Cast(Value(device_ids), ArrayField(models.IntegerField()))),
+            'best_score': Greatest('best_score', Value(best_score)),
+            'updated_at': timezone.now(),
+        }
+        if self.filter(employee_id=employee_id, date=date).update(**merge):
+            return
+        try:
+            with transaction.atomic():
+                self.create(
+                    employee_id=employee_id, date=date, first_seen=first_seen, last_seen=last_seen,
+                    detection_count=detection_count, device_ids=device_ids, best_score=best_score,
+                )
+        except IntegrityError:
+            # Another request created the row first
+            self.filter(employee_id=employee_id, date=date).update(**merge)
+
+    def rebuild(self, days):
+        """Recomputes the given ``(employee_id, date)`` rows from the raw attendances."""
+        for employee_id, date in sorted(set(days)):
+            start = timezone.make_aware(datetime.combine(date, time.min))
+            summary = EmployeeAttendanceModel.objects.filter(
+                employee_id=employee_id, datetime__gte=start, datetime__lt=start + timedelta(days=1),
+            ).aggregate(**self.summary_aggregates())
+            if summary['detection_count']:
+                self.update_or_create(employee_id=employee_id, date=date, defaults=summary)
+            else:
+                self.filter(employee_id=employee_id, date=date).delete()
+
+    @staticmethod
+    def summary_aggregates():
+        return {
+            'first_seen': Min('datetime'),
+            'last_seen': Max('datetime'),
+            'detection_count': Count('id'),
+            'device_ids': ArrayAgg('device_id', distinct=True, ordering='device_id'),
+            'best_score': Max('score'),
+        }
+
+
+class EmployeeDailyAttendanceModel(SharedModel):
+    """Per employee and day rollup of ``EmployeeAttendanceModel``, kept up to date as attendances arrive."""
+    employee = models.ForeignKey(EmployeeModel, on_delete=models.CASCADE, related_name='daily_attendances')
+    date = models.DateField(db_index=True)
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+    detection_count = models.IntegerField(default=0)
+    device_ids = ArrayField(models.IntegerField(), default=list)
+    best_score = models.FloatField()
+
+    objects = EmployeeDailyAttendanceQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.date} {self.employee}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'date'], name='unique_employee_daily_attendance'),
+        ]
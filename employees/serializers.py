@@ -1,8 +1,23 @@
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import EmployeeModel, EmployeeAttendanceModel
+
+from attendify_drf.embeddings import EmbeddingField
+from attendify_drf.filters import FilterSerializer
+from attendify_drf.images import ImageUploadField
+from attendify_drf.live_stats import live_stats
+from attendify_drf.thumbnails import ThumbnailField, schedule_thumbnail
+from sharedapp.models import ImageBlobModel
+from .dedup import deduplicator
+from .models import EmployeeModel, EmployeeAttendanceModel, EmployeeDailyAttendanceModel
+from .signals import send_attendance_bulk_event
 
 
 class EmployeeSerializer(serializers.ModelSerializer):
+    image = ImageUploadField(required=False, allow_null=True)
+    image_thumbnail = ThumbnailField(source='image')
+    embedding = EmbeddingField(required=False, allow_null=True, write_only=True)
+
     class Meta:
         model = EmployeeModel
         fields = '__all__'
@@ -14,6 +29,9 @@ class EmployeeSerializer(serializers.ModelSerializer):
 
 
 class EmployeeAttendanceSerializer(serializers.ModelSerializer):
+    image = ImageUploadField()
+    image_thumbnail = ThumbnailField(source='image')
+
     class Meta:
         model = EmployeeAttendanceModel
         fields = '__all__'
@@ -23,5 +41,125 @@ class EmployeeAttendanceSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        return super().create(validated_data)
+        with transaction.atomic():
+            attendance = super().create(validated_data)
+            EmployeeDailyAttendanceModel.objects.record_attendances([attendance])
+        return attendance
+
+    def update(self, instance, validated_data):
+        previous_day = (instance.employee_id, timezone.localdate(instance.datetime))
+        with transaction.atomic():
+            attendance = super().update(instance, validated_data)
+            EmployeeDailyAttendanceModel.objects.rebuild([
+                previous_day, (attendance.employee_id, timezone.localdate(attendance.datetime)),
+            ])
+        return attendance
+
+
+class EmployeeAttendanceListSerializer(serializers.ListSerializer):
+    def validate(self, data):
+        data = super().validate(data)
+        # Check every referenced employee with one query instead of one per record
+        employee_ids = {item['employee_id'] for item in data}
+        existing = set(EmployeeModel.objects.filter(pk__in=employee_ids).values_list('pk', flat=True))
+        missing = employee_ids - existing
+        if missing:
+            raise serializers.ValidationError(
+                f'Invalid employee ids: {", ".join(str(pk) for pk in sorted(missing))}.'
+            )
+        return data
+
+    def create(self, validated_data):
+        attendances = []
+        # Repeats within the batch are merged before the cache is consulted for earlier requests' windows
+        for item in deduplicator.collapse(validated_data):
+            duplicate = deduplicator.claim(item['employee_id'], item['device_id'], item['datetime'])
+            if duplicate is None:
+                attendances.append(EmployeeAttendanceModel(**item))
+            else:
+                deduplicator.replace_if_better(duplicate, item['score'], item['image'])
+        try:
+            with transaction.atomic():
+                attendances = EmployeeAttendanceModel.objects.bulk_create(attendances)
+                EmployeeDailyAttendanceModel.objects.record_attendances(attendances)
+                # bulk_create() skips the signals that count image references
+                ImageBlobModel.objects.retain(attendance.image.name for attendance in attendances)
+                for attendance in attendances:
+                    schedule_thumbnail(attendance.image)
+                live_stats.record('employees', [
+                    (attendance.employee_id, attendance.device_id, attendance.datetime) for attendance in attendances
+                ])
+        except Exception:
+            for attendance in attendances:
+                deduplicator.release(attendance.employee_id, attendance.device_id, attendance.datetime)
+            raise
+        for attendance in attendances:
+            deduplicator.remember(attendance)
+        if attendances:
+            send_attendance_bulk_event(attendances)
+        return attendances
+
+
+class EmployeeAttendanceBulkSerializer(serializers.ModelSerializer):
+    employee = serializers.IntegerField(source='employee_id')
+    image = ImageUploadField()
+    image_thumbnail = ThumbnailField(source='image')
+
+    class Meta:
+        model = EmployeeAttendanceModel
+        fields = ['id', 'employee', 'device_id', 'image', 'image_thumbnail', 'datetime', 'score']
+        list_serializer_class = EmployeeAttendanceListSerializer
+
 
+class EmployeeAttendanceFilterSerializer(FilterSerializer):
+    employee = serializers.IntegerField(required=False)
+    device_id = serializers.IntegerField(required=False)
+    datetime_from = serializers.DateTimeField(required=False, help_text='Inclusive lower bound')
+    datetime_to = serializers.DateTimeField(required=False, help_text='Exclusive upper bound')
+    min_score = serializers.FloatField(required=False)
+
+    lookups = {
+        'employee': 'employee_id',
+        'device_id': 'device_id',
+        'datetime_from': 'datetime__gte',
+        'datetime_to': 'datetime__lt',
+        'min_score': 'score__gte',
+    }
+
+    def validate(self, data):
+        data = super().validate(data)
+        if 'datetime_from' in data and 'datetime_to' in data and data['datetime_from'] >= data['datetime_to']:
+            raise serializers.ValidationError('datetime_from must be earlier than datetime_to.')
+        return data
+
+
+class EmployeeDailyAttendanceSerializer(serializers.ModelSerializer):
+    hours_on_site = serializers.SerializerMethodField()
+
+    class Meta:
+        model = EmployeeDailyAttendanceModel
+        fields = [
+            'id', 'employee', 'date', 'first_seen', 'last_seen', 'hours_on_site',
+            'detection_count', 'device_ids', 'best_score',
+        ]
+
+    def get_hours_on_site(self, obj) -> float:
+        return round((obj.last_seen - obj.first_seen).total_seconds() / 3600, 2)
+
+
+class EmployeeDailyAttendanceFilterSerializer(FilterSerializer):
+    employee = serializers.IntegerField(required=False)
+    date_from = serializers.DateField(required=False, help_text='Inclusive')
+    date_to = serializers.DateField(required=False, help_text='Inclusive')
+
+    lookups = {
+        'employee': 'employee_id',
+        'date_from': 'date__gte',
+        'date_to': 'date__lte',
+    }
+
+    def validate(self, data):
+        data = super().validate(data)
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError('date_from must not be later than date_to.')
+        return data
@@ -1,31 +1,16 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from attendify_drf.cache import invalidate_cached_responses
+from attendify_drf.events import send_bulk_group_event, send_group_event
+from attendify_drf.live_stats import live_stats
+from attendify_drf.thumbnails import schedule_thumbnail
+from .faces import employee_face_index
 from .models import EmployeeModel, EmployeeAttendanceModel
-from datetime import datetime
-import json
-
-def send_group_event(event_name, data):
-    # Serialize datetime objects to strings
-    def serialize(obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        raise TypeError("Type %s not serializable" % type(obj))
-
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'broadcast',
-        {
-            'type': 'send_event',
-            'event': event_name,
-            'data': json.loads(json.dumps(data, default=serialize)),  # Serialize data
-        }
-    )
 
 
 @receiver(post_save, sender=EmployeeModel)
 def employee_update_handler(sender, instance, created, **kwargs):
+    invalidate_cached_responses('employees')
     if created:
         event = 'employee_create'
     else:
@@ -36,35 +21,58 @@ def employee_update_handler(sender, instance, created, **kwargs):
         'last_name': instance.last_name,
         'email': instance.email,
         'phone_number': instance.phone_number,
-        'image': instance.image.url,
+        'image': instance.image.url if instance.image else None,
     }
-    send_group_event(event, data)
+    send_group_event(event, data, employee=instance.id)
+    schedule_thumbnail(instance.image)
+    if not created or instance.embedding is not None:
+        employee_face_index.update(instance)
 
 @receiver(post_delete, sender=EmployeeModel)
 def employee_delete_handler(sender, instance, **kwargs):
+    invalidate_cached_responses('employees')
+    employee_face_index.remove(instance.id)
     data = {
         'id': instance.id
     }
-    send_group_event('employee_delete', data)
+    send_group_event('employee_delete', data, employee=instance.id)
+
+def attendance_event_data(instance):
+    return {
+        'employee_id': instance.employee_id,
+        'device_id': instance.device_id,
+        'image': instance.image.url,
+        'datetime': instance.datetime,
+        'score': instance.score
+    }
+
+
+def send_attendance_bulk_event(instances):
+    # bulk_create() bypasses post_save, so a whole batch is announced as a single event;
+    # employee and device subscribers only get their own records
+    send_bulk_group_event(
+        'employee_attendance_bulk',
+        [attendance_event_data(instance) for instance in instances],
+        employee=[instance.employee_id for instance in instances],
+        device=[instance.device_id for instance in instances],
+    )
+
 
 @receiver(post_save, sender=EmployeeAttendanceModel)
 def employee_attendance_handler(sender, instance, created, **kwargs):
+    schedule_thumbnail(instance.image)
     if created:
-        event = 'employee_attendance'
-        data = {
-            'employee_id': instance.employee.id,
-            'device_id': instance.device_id,
-            'image': instance.image.url,
-            'datetime': instance.datetime,
-            'score': instance.score
-        }
-        send_group_event(event, data)
+        live_stats.record('employees', [(instance.employee_id, instance.device_id, instance.datetime)])
+        send_group_event(
+            'employee_attendance', attendance_event_data(instance),
+            employee=instance.employee_id, device=instance.device_id,
+        )
 
 
 @receiver(post_delete, sender=EmployeeAttendanceModel)
 def employee_attendance_delete_handler(sender, instance, **kwargs):
     data = {
-        'employee_id': instance.employee.id,
+        'employee_id': instance.employee_id,
         'datetime': instance.datetime
     }
-    send_group_event('employee_attendance_delete', data)
+    send_group_event('employee_attendance_delete', data, employee=instance.employee_id, device=instance.device_id)
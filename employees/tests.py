@@ -1,3 +1,388 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+from datetime import date, datetime, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.files.storage import storages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from attendify_drf.consumers import MyConsumer
+from attendify_drf.events import EventDispatcher, dispatcher
+from attendify_drf.storage import ContentAddressedStorage
+from attendify_drf.thumbnails import generate_thumbnail
+from .models import (
+    EmployeeModel, EmployeeAttendanceModel, EmployeeDailyAttendanceModel, EmployeeDailyAttendanceQuerySet,
+)
+from .serializers import EmployeeAttendanceSerializer
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_employee(n):
+    return EmployeeModel.objects.create(
+        first_name=f'Employee{n}', last_name='Test', email=f'employee{n}@example.com', phone_number=str(n),
+    )
+
+
+def image_file(name='frame.png', color=(255, 0, 0)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKER={'MAX_WORKERS': 0})
+class EmployeeAttendanceBulkViewTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.employee = create_employee(1)
+
+    def record(self, moment, score, image, device_id=1):
+        return {
+            'employee': self.employee.id, 'device_id': device_id, 'datetime': moment, 'score': score, 'image': image,
+        }
+
+    def post_records(self, records, **files):
+        return self.client.post(
+            '/employees/attendance/bulk/', {'records': json.dumps(records), **files}, format='multipart',
+        )
+
+    def test_non_string_image_reference_is_a_validation_error(self):
+        for image in (['frame'], {'name': 'frame'}, 1):
+            response = self.post_records([{
+                'employee': self.employee.id, 'device_id': 1, 'datetime': '2024-01-01T08:00:00Z',
+                'score': 0.9, 'image': image,
+            }], frame=image_file())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('image', response.json()['errors'][0])
+
+    def test_backlog_batch_keeps_windows_apart_by_detection_time(self):
+        response = self.post_records([
+            self.record('2024-01-01T17:00:05Z', 0.7, 'f4'),
+            self.record('2024-01-01T08:00:00Z', 0.6, 'f1'),
+            self.record('2024-01-01T08:00:10Z', 0.9, 'f2'),
+            self.record('2024-01-01T08:00:20Z', 0.8, 'f1'),
+            self.record('2024-01-01T17:00:00Z', 0.5, 'f3'),
+            self.record('2024-01-01T08:00:05Z', 0.4, 'f1', device_id=2),
+        ], f1=image_file(color=(1, 0, 0)), f2=image_file(color=(2, 0, 0)), f3=image_file(color=(3, 0, 0)),
+            f4=image_file(color=(4, 0, 0)))
+        self.assertEqual(response.status_code, 201)
+
+        stored = list(EmployeeAttendanceModel.objects.order_by('datetime', 'device_id').values_list(
+            'device_id', 'datetime', 'score', 'image',
+        ))
+        self.assertEqual([(device_id, moment.isoformat(), score) for device_id, moment, score, _ in stored], [
+            (1, '2024-01-01T08:00:00+00:00', 0.9),
+            (2, '2024-01-01T08:00:05+00:00', 0.4),
+            (1, '2024-01-01T17:00:00+00:00', 0.7),
+        ])
+        # The best detection's image is kept with the window's first detection time
+        self.assertEqual(
+            stored[0][3], ContentAddressedStorage.hashed_name('employees/attendances/frame.png', image_file(color=(2, 0, 0))),
+        )
+
+        day = EmployeeDailyAttendanceModel.objects.get(employee=self.employee)
+        self.assertEqual((day.first_seen.hour, day.last_seen.hour, day.detection_count), (8, 17, 3))
+
+    def test_thumbnail_url_falls_back_to_the_image_until_generated(self):
+        response = self.post_records([self.record('2024-01-01T08:00:00Z', 0.5, 'f1')], f1=image_file())
+        [record] = response.json()['data']
+        self.assertEqual(record['image_thumbnail'], record['image'])
+
+        attendance = EmployeeAttendanceModel.objects.get()
+        generate_thumbnail(attendance.image.name)
+        # Availability is read from the flag set by generate_thumbnail, not from the storage
+        with mock.patch.object(storages['thumbnails'], 'exists', side_effect=AssertionError) as exists:
+            data = EmployeeAttendanceSerializer(attendance).data
+        exists.assert_not_called()
+        self.assertTrue(data['image_thumbnail'].endswith(f'/thumbnails/{attendance.image.name[:-4]}.webp'))
+
+    def test_later_requests_are_deduplicated_against_the_cached_window(self):
+        self.post_records([self.record('2024-01-01T17:00:00Z', 0.5, 'f1')], f1=image_file())
+        response = self.post_records([
+            self.record('2024-01-01T17:00:20Z', 0.8, 'f1'),
+            self.record('2024-01-01T08:00:00Z', 0.6, 'f1'),
+            self.record('2024-01-01T17:01:00Z', 0.3, 'f1'),
+        ], f1=image_file(color=(0, 255, 0)))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [record['datetime'] for record in response.json()['data']], ['2024-01-01T08:00:00Z', '2024-01-01T17:01:00Z'],
+        )
+        self.assertEqual(
+            list(EmployeeAttendanceModel.objects.order_by('datetime').values_list('score', flat=True)), [0.6, 0.8, 0.3],
+        )
+
+
+    def test_detail_view_updates_and_deletes_with_the_daily_rollup(self):
+        self.post_records([self.record('2024-01-01T08:00:00Z', 0.5, 'f1')], f1=image_file())
+        attendance = EmployeeAttendanceModel.objects.get()
+        url = f'/employees/attendance/{attendance.id}/'
+        self.assertEqual(self.client.get(url).json()['data']['score'], 0.5)
+
+        response = self.client.put(url, {
+            'employee': self.employee.id, 'device_id': 1, 'datetime': '2024-01-02T09:00:00Z', 'score': 0.7,
+            'image': image_file(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(EmployeeDailyAttendanceModel.objects.values_list('date', 'best_score')), [(date(2024, 1, 2), 0.7)],
+        )
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(EmployeeDailyAttendanceModel.objects.exists())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class EmployeeAttendanceListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.first, self.second = create_employee(1), create_employee(2)
+        self.attendances = [
+            EmployeeAttendanceModel.objects.create(
+                employee=employee, device_id=device_id, image='a.png', score=score,
+                datetime=datetime(2024, 1, 1, hour, tzinfo=dt_timezone.utc),
+            )
+            # Two detections share 10:00, so pages have to be split between equal datetimes
+            for employee, device_id, score, hour in [
+                (self.first, 1, 0.9, 8), (self.second, 1, 0.4, 9), (self.first, 2, 0.7, 10),
+                (self.second, 2, 0.8, 10), (self.first, 1, 0.5, 11),
+            ]
+        ]
+
+    def ids(self, *attendances):
+        return [attendance.id for attendance in attendances]
+
+    def get(self, url='/employees/attendance/', **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_filters(self):
+        first_8, second_9, first_10, second_10, first_11 = self.attendances
+        self.assertEqual([row['id'] for row in self.get(employee=self.first.id)['results']],
+                         self.ids(first_11, first_10, first_8))
+        self.assertEqual([row['id'] for row in self.get(device_id=2, min_score=0.75)['results']], self.ids(second_10))
+        self.assertEqual(
+            [row['id'] for row in self.get(datetime_from='2024-01-01T09:00:00Z', datetime_to='2024-01-01T11:00:00Z')['results']],
+            self.ids(second_10, first_10, second_9),
+        )
+
+    def test_invalid_filters_are_rejected(self):
+        for params in ({'datetime_from': '2024-01-01T10:00:00Z', 'datetime_to': '2024-01-01T10:00:00Z'},
+                       {'employee': 'first'}, {'min_score': 'high'}):
+            self.assertEqual(self.client.get('/employees/attendance/', params).status_code, 400, params)
+
+    def test_cursor_pages_stay_put_when_newer_rows_arrive(self):
+        page = self.get(page_size=2)
+        self.assertIsNone(page['previous'])
+        ids = [row['id'] for row in page['results']]
+        # A detection arriving between requests doesn't shift the following pages
+        EmployeeAttendanceModel.objects.create(
+            employee=self.first, device_id=1, image='a.png', score=0.6, datetime=datetime(2024, 1, 1, 12, tzinfo=dt_timezone.utc),
+        )
+        while page['next']:
+            self.assertIn('page_size=2', page['next'])
+            page = self.get(page['next'])
+            self.assertLessEqual(len(page['results']), 2)
+            ids.extend(row['id'] for row in page['results'])
+        self.assertEqual(ids, self.ids(*sorted(self.attendances, key=lambda row: (row.datetime, row.id), reverse=True)))
+
+
+class EventDispatcherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dispatcher = EventDispatcher()
+
+    def queued_events(self, send, *args, **kwargs):
+        events = []
+        self.dispatcher._enqueue = events.append
+        with self.captureOnCommitCallbacks(execute=True):
+            send(*args, **kwargs)
+        return events
+
+    def test_only_subscribed_groups_are_sent_to(self):
+        self.dispatcher.subscribe('a', ['broadcast', 'employee.1'])
+        self.dispatcher.subscribe('b', ['employee.1'])
+        self.dispatcher.unsubscribe('b', ['employee.1', 'employee.2'])
+        events = self.queued_events(self.dispatcher.send, 'employee_update', {'id': 1}, employee=[1, 2])
+        self.dispatcher.subscribe('c', ['employee.2'])
+        self.dispatcher.unsubscribe('c', ['employee.2'])
+        subscribed = self.dispatcher.subscribed(events[0][3])
+        # Nobody has ever subscribed to event.employee_update, so its subscribers are unknown
+        self.assertEqual(subscribed, {'broadcast', 'employee.1', 'event.employee_update'})
+        self.assertEqual(set(EventDispatcher.group_messages(events, subscribed)), subscribed)
+
+        self.dispatcher.unsubscribe('a', ['employee.1'])
+        self.assertEqual(self.dispatcher.subscribed(['employee.1', 'employee.2']), set())
+
+    def test_subscriptions_expire_without_heartbeats(self):
+        self.dispatcher.subscriber_ttl = 60
+        with mock.patch('attendify_drf.events.time.time', return_value=1000):
+            self.dispatcher.subscribe('a', ['employee.1'])
+        with mock.patch('attendify_drf.events.time.time', return_value=1059):
+            self.assertEqual(self.dispatcher.subscribed(['employee.1']), {'employee.1'})
+        with mock.patch('attendify_drf.events.time.time', return_value=1061):
+            self.assertEqual(self.dispatcher.subscribed(['employee.1']), set())
+
+    def test_groups_are_sent_to_when_subscribers_are_unknown(self):
+        self.dispatcher.subscribe('a', ['employee.1'])
+        self.dispatcher.unsubscribe('a', ['employee.1'])
+        self.assertEqual(self.dispatcher.subscribed(['employee.1']), set())
+        cache.clear()
+        self.assertEqual(self.dispatcher.subscribed(['employee.1']), {'employee.1'})
+        redis_down = mock.patch.object(self.dispatcher, 'redis', side_effect=ConnectionError)
+        with redis_down, self.assertLogs('attendify_drf.events'):
+            self.assertEqual(self.dispatcher.subscribed(['employee.1', 'employee.2']), {'employee.1', 'employee.2'})
+
+    def test_topic_groups_get_their_slice_of_a_bulk_event(self):
+        records = [{'employee_id': 1, 'device_id': 7}, {'employee_id': 2, 'device_id': 7}, {'employee_id': 1, 'device_id': 8}]
+        events = self.queued_events(
+            self.dispatcher.send_bulk, 'employee_attendance_bulk', records,
+            employee=[record['employee_id'] for record in records], device=[record['device_id'] for record in records],
+        )
+        group_messages = EventDispatcher.group_messages(
+            events, {'broadcast', 'employee.1', 'employee.3', 'device.7', 'device.8'},
+        )
+        self.assertEqual(set(group_messages), {'broadcast', 'employee.1', 'device.7', 'device.8'})
+
+        def data(group):
+            [message] = group_messages[group]
+            return [json.loads(item) for item in message['items']]
+
+        self.assertEqual(data('broadcast'), records)
+        self.assertEqual(data('employee.1'), [records[0], records[2]])
+        self.assertEqual(data('device.7'), [records[0], records[1]])
+        self.assertEqual(data('device.8'), [records[2]])
+        # Every slice is the same event, so sockets in several groups can drop the items they already have
+        self.assertEqual(len({messages[0]['id'] for messages in group_messages.values()}), 1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ConsumerTests(TestCase):
+    def setUp(self):
+        # Events queued by earlier tests would otherwise reach these sockets
+        dispatcher.flush()
+        cache.clear()
+
+    async def connect(self, path='/ws/'):
+        communicator = WebsocketCommunicator(MyConsumer.as_asgi(), path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def subscribe(self, communicator, *topics):
+        await communicator.send_json_to({'action': 'subscribe', 'topics': list(topics)})
+        return await communicator.receive_json_from()
+
+    async def publish(self, *events):
+        await EventDispatcher()._publish(EventDispatcher.group_messages(events, set(get_channel_layer().groups)))
+
+    async def test_overlapping_topics_receive_each_bulk_item_once(self):
+        communicator = await self.connect()
+        await self.subscribe(communicator, 'employee:1', 'device:7')
+        records = [
+            {'employee_id': 1, 'device_id': 7}, {'employee_id': 2, 'device_id': 7}, {'employee_id': 1, 'device_id': 8},
+        ]
+        groups = {'broadcast': (0, 1, 2), 'employee.1': (0, 2), 'employee.2': (1,), 'device.7': (0, 1), 'device.8': (2,)}
+        await self.publish(
+            ('bulk', 'employee_attendance_bulk', records, groups),
+            ('plain', 'employee_update', {'id': 1}, {'broadcast': None, 'employee.1': None}),
+        )
+
+        frames = []
+        while not await communicator.receive_nothing(timeout=0.05):
+            frames.append(await communicator.receive_json_from())
+        bulk_frames = [frame['data'] for frame in frames if frame['event'] == 'employee_attendance_bulk']
+        self.assertCountEqual([record for data in bulk_frames for record in data], records)
+        self.assertEqual([frame['data'] for frame in frames if frame['event'] == 'employee_update'], [{'id': 1}])
+        await communicator.disconnect()
+
+    async def test_invalid_topics_get_an_error_frame(self):
+        communicator = await self.connect()
+        for message in ({'action': 'subscribe', 'topics': [3]}, {'action': 'subscribe', 'topics': [['employee:1']]},
+                        {'action': 'subscribe', 'topics': ['employee']}, {'action': 'subscribe', 'topics': ['nope:1']},
+                        {'action': 'join', 'topics': []}, ['subscribe']):
+            await communicator.send_json_to(message)
+            self.assertEqual((await communicator.receive_json_from())['event'], 'error')
+        self.assertEqual(await self.subscribe(communicator, 'employee:1'), {
+            'event': 'subscriptions', 'data': {'topics': ['employee:1']},
+        })
+        await communicator.disconnect()
+
+    def plain_event(self, n):
+        return (f'e{n}', 'employee_update', {'id': n}, {'broadcast': None})
+
+    async def test_batched_events_are_sent_once_the_batch_is_full(self):
+        communicator = await self.connect('/ws/?batch_window=1000&batch_size=2')
+        await self.publish(self.plain_event(1))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.05))
+        await self.publish(self.plain_event(2), self.plain_event(3))
+        # Well before the window elapses
+        self.assertEqual(await communicator.receive_json_from(timeout=0.2), [
+            {'event': 'employee_update', 'data': {'id': 1}}, {'event': 'employee_update', 'data': {'id': 2}},
+        ])
+        self.assertEqual(await communicator.receive_json_from(timeout=0.2), [
+            {'event': 'employee_update', 'data': {'id': 3}},
+        ])
+        await communicator.disconnect()
+
+    async def test_batched_events_are_sent_once_the_window_elapses(self):
+        communicator = await self.connect('/ws/?batch_window=50&batch_size=10')
+        await self.publish(self.plain_event(1))
+        await self.publish(self.plain_event(2))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.01))
+        self.assertEqual(await communicator.receive_json_from(timeout=1), [
+            {'event': 'employee_update', 'data': {'id': 1}}, {'event': 'employee_update', 'data': {'id': 2}},
+        ])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+        await communicator.disconnect()
+
+    async def test_disconnect_cancels_the_pending_flush(self):
+        consumers = []
+        connect = MyConsumer.connect
+
+        async def recording_connect(consumer):
+            consumers.append(consumer)
+            await connect(consumer)
+
+        with mock.patch.object(MyConsumer, 'connect', recording_connect):
+            communicator = await self.connect('/ws/?batch_window=1000')
+        await self.publish(self.plain_event(1))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.05))
+        [consumer] = consumers
+        flush_task = consumer.flush_task
+        self.assertIsNotNone(flush_task)
+        await communicator.disconnect()
+        await asyncio.sleep(0)
+        self.assertTrue(flush_task.cancelled())
+
+
+class EmployeeDailyAttendanceTests(TestCase):
+    def test_rows_are_upserted_in_key_order(self):
+        first, second = create_employee(1), create_employee(2)
+        attendances = [
+            EmployeeAttendanceModel(employee=employee, device_id=1, image='a.png', score=score,
+                                    datetime=datetime(2024, 1, day, 9, tzinfo=dt_timezone.utc))
+            for employee, day, score in [(second, 2, 0.5), (first, 3, 0.6), (second, 1, 0.7), (first, 2, 0.8)]
+        ]
+        upsert = EmployeeDailyAttendanceQuerySet.upsert
+        with mock.patch.object(EmployeeDailyAttendanceQuerySet, 'upsert', autospec=True, side_effect=upsert) as spy:
+            EmployeeDailyAttendanceModel.objects.record_attendances(attendances)
+        keys = [call.args[1:3] for call in spy.call_args_list]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(EmployeeDailyAttendanceModel.objects.count(), 4)
@@ -1,9 +1,16 @@
 from django.urls import path
-from .views import EmployeeView, EmployeeDetailView, EmployeeAttendanceView, EmployeeAttendanceDetailView
+from .views import (
+    EmployeeView, EmployeeMatchView, EmployeeDetailView, EmployeeAttendanceView, EmployeeAttendanceBulkView, EmployeeAttendanceExportView,
+    EmployeeAttendanceDetailView, EmployeeDailyAttendanceView,
+)
 
 urlpatterns = [
     path('', EmployeeView.as_view(), name='employees'),
+    path('match/', EmployeeMatchView.as_view(), name='employee_match'),
     path('<int:pk>/', EmployeeDetailView.as_view(), name='employee_detail'),
     path('attendance/', EmployeeAttendanceView.as_view(), name='employee_attendance'),
+    path('attendance/bulk/', EmployeeAttendanceBulkView.as_view(), name='employee_attendance_bulk'),
+    path('attendance/export/', EmployeeAttendanceExportView.as_view(), name='employee_attendance_export'),
+    path('attendance/daily/', EmployeeDailyAttendanceView.as_view(), name='employee_attendance_daily'),
     path('attendance/<int:pk>/', EmployeeAttendanceDetailView.as_view(), name='employee_attendance_detail'),
 ]
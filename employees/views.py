@@ -1,3 +1,9 @@
+import json
+
+from adrf.views import APIView as AsyncAPIView
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
@@ -6,12 +12,20 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import EmployeeModel, EmployeeAttendanceModel
-from .serializers import EmployeeSerializer, EmployeeAttendanceSerializer
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from attendify_drf.async_views import asave
+from attendify_drf.cache import cached_response
+from attendify_drf.embeddings import FaceMatchSerializer, match_faces
+from attendify_drf.exports import ExportFormatSerializer, file_url, streaming_export
+from attendify_drf.pagination import DateCursorPagination, DateTimeCursorPagination
+from .dedup import deduplicator
+from .faces import employee_face_index
+from .models import EmployeeModel, EmployeeAttendanceModel, EmployeeDailyAttendanceModel
+from .serializers import (
+    EmployeeSerializer, EmployeeAttendanceSerializer, EmployeeAttendanceBulkSerializer,
+    EmployeeAttendanceFilterSerializer, EmployeeDailyAttendanceSerializer, EmployeeDailyAttendanceFilterSerializer,
+)
 
-class EmployeeView(APIView):
+class EmployeeView(AsyncAPIView):
     serializer_class = EmployeeSerializer
     # 
     parser_classes = [MultiPartParser, FormParser]
@@ -22,10 +36,9 @@ class EmployeeView(APIView):
         operation_description='Create a new employee with the provided details',
         responses={201: 'Employee created', 400: 'Bad Request'}
     )
-    def post(self, request):
+    async def post(self, request):
         serializer = self.serializer_class(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
+        if await asave(serializer):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -34,9 +47,10 @@ class EmployeeView(APIView):
         operation_description='Get all employees',
         responses={200: EmployeeSerializer(many=True)}
     )
-    def get(self, request):
+    @cached_response('employees')
+    async def get(self, request):
         try:
-            employees = EmployeeModel.objects.all()
+            employees = [employee async for employee in EmployeeModel.objects.defer('embedding')]
             serializer = EmployeeSerializer(employees, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except EmployeeModel.DoesNotExist:
@@ -45,7 +59,23 @@ class EmployeeView(APIView):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class EmployeeDetailView(APIView):
+class EmployeeMatchView(APIView):
+    serializer_class = FaceMatchSerializer
+
+    @swagger_auto_schema(
+        request_body=serializer_class,
+        operation_summary='Match a face embedding against employees',
+        operation_description='Get the employees whose face embeddings are most similar to the given one, best first',
+        responses={200: 'Employee ids with cosine similarity scores', 400: 'Bad Request'}
+    )
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(match_faces(employee_face_index, **serializer.validated_data), status=status.HTTP_200_OK)
+
+
+class EmployeeDetailView(AsyncAPIView):
     serializer_class = EmployeeSerializer
     
 
@@ -54,9 +84,10 @@ class EmployeeDetailView(APIView):
         operation_description='Get an employee by ID',
         responses={200: EmployeeSerializer}
     )
-    def get(self, request, pk):
+    @cached_response('employees')
+    async def get(self, request, pk):
         try:
-            employee = EmployeeModel.objects.get(pk=pk)
+            employee = await EmployeeModel.objects.aget(pk=pk)
             serializer = EmployeeSerializer(employee)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except EmployeeModel.DoesNotExist:
@@ -69,12 +100,11 @@ class EmployeeDetailView(APIView):
         operation_description='Update an employee by ID',
         responses={200: EmployeeSerializer}
     )
-    def put(self, request, pk):
+    async def put(self, request, pk):
         try:
-            employee = EmployeeModel.objects.get(pk=pk)
+            employee = await EmployeeModel.objects.aget(pk=pk)
             serializer = EmployeeSerializer(employee, data=request.data)
-            if serializer.is_valid():
-                serializer.save()
+            if await asave(serializer):
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except EmployeeModel.DoesNotExist:
@@ -87,10 +117,10 @@ class EmployeeDetailView(APIView):
         operation_description='Delete an employee by ID',
         responses={204: 'Employee deleted'}
     )
-    def delete(self, request, pk):
+    async def delete(self, request, pk):
         try:
-            employee = EmployeeModel.objects.get(pk=pk)
-            employee.delete()
+            employee = await EmployeeModel.objects.aget(pk=pk)
+            await employee.adelete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except EmployeeModel.DoesNotExist:
             return Response({'detail': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -98,40 +128,152 @@ class EmployeeDetailView(APIView):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class EmployeeAttendanceView(APIView):
+class EmployeeAttendanceView(AsyncAPIView):
     serializer_class = EmployeeAttendanceSerializer
     parser_classes = [MultiPartParser, FormParser]
+    pagination_class = DateTimeCursorPagination
 
     @swagger_auto_schema(
         request_body=serializer_class,
         operation_summary='Create a new attendance',
         operation_description='Create a new attendance with the provided details',
-        responses={201: 'Attendance created', 400: 'Bad Request'}
+        responses={201: 'Attendance created', 200: 'Duplicate detection within the dedup window', 400: 'Bad Request'}
     )
-    def post(self, request):
+    async def post(self, request):
         serializer = self.serializer_class(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if await sync_to_async(serializer.is_valid)():
+            return await sync_to_async(self.store)(serializer)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def store(self, serializer):
+        employee_id = serializer.validated_data['employee'].id
+        device_id = serializer.validated_data['device_id']
+        moment = serializer.validated_data['datetime']
+        duplicate = deduplicator.claim(employee_id, device_id, moment)
+        if duplicate is not None:
+            deduplicator.replace_if_better(
+                duplicate, serializer.validated_data['score'], serializer.validated_data['image']
+            )
+            return Response({'detail': 'Duplicate detection', 'id': duplicate['id']}, status=status.HTTP_200_OK)
+        try:
+            serializer.save()
+        except Exception:
+            deduplicator.release(employee_id, device_id, moment)
+            raise
+        deduplicator.remember(serializer.instance)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @swagger_auto_schema(
         operation_summary='Get all attendances',
-        operation_description='Get all attendances',
+        operation_description='Get attendances, newest first, one cursor page at a time',
+        query_serializer=EmployeeAttendanceFilterSerializer,
         responses={200: EmployeeAttendanceSerializer(many=True)}
     )
-    def get(self, request):
+    async def get(self, request):
+        filters = EmployeeAttendanceFilterSerializer(data=request.query_params)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
         try:
-            attendances = EmployeeAttendanceModel.objects.all()
-            serializer = EmployeeAttendanceSerializer(attendances, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            attendances = filters.filter_queryset(EmployeeAttendanceModel.objects.all())
+            paginator = self.pagination_class()
+            page = await paginator.apaginate_queryset(attendances, request, view=self)
+            serializer = EmployeeAttendanceSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         except EmployeeAttendanceModel.DoesNotExist:
             return Response({'detail': 'No attendances found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class EmployeeAttendanceDetailView(APIView):
+class EmployeeAttendanceExportView(APIView):
+    fields = ['id', 'employee', 'device_id', 'datetime', 'score', 'image']
+
+    @swagger_auto_schema(
+        operation_summary='Export attendances',
+        operation_description='Stream every matching attendance, oldest first, as CSV or NDJSON',
+        query_serializer=EmployeeAttendanceFilterSerializer,
+        manual_parameters=[
+            openapi.Parameter('export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['csv', 'ndjson']),
+        ],
+        responses={200: 'Attendance export'}
+    )
+    def get(self, request):
+        export = ExportFormatSerializer(data=request.query_params)
+        filters = EmployeeAttendanceFilterSerializer(data=request.query_params)
+        if not export.is_valid():
+            return Response(export.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+        attendances = filters.filter_queryset(EmployeeAttendanceModel.objects.order_by('datetime', 'id'))
+        return streaming_export(
+            attendances, self.fields, 'attendances', export.validated_data['export_format'],
+            converters={'image': file_url},
+        )
+
+
+class EmployeeAttendanceBulkView(AsyncAPIView):
+    serializer_class = EmployeeAttendanceBulkSerializer
+    parser_classes = [MultiPartParser, FormParser]
+    max_records = 500
+
+    @swagger_auto_schema(
+        operation_summary='Create attendances in bulk',
+        operation_description=(
+            'Create a batch of attendances in one request. `records` is a JSON array of objects with '
+            '`employee`, `device_id`, `datetime`, `score` and `image`, where `image` is the name of '
+            'the multipart file part holding that record\'s image. The batch is saved atomically.'
+        ),
+        manual_parameters=[
+            openapi.Parameter('records', openapi.IN_FORM, type=openapi.TYPE_STRING, required=True),
+        ],
+        responses={201: EmployeeAttendanceBulkSerializer(many=True), 400: 'Bad Request'}
+    )
+    async def post(self, request):
+        try:
+            records = json.loads(request.data.get('records', ''))
+        except ValueError:
+            records = None
+        if not isinstance(records, list):
+            return Response({'records': ['Expected a JSON array of attendance records.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        for record in records:
+            # Anything but a part name is left for the serializer to reject
+            if isinstance(record, dict) and isinstance(record.get('image'), str):
+                record['image'] = request.FILES.get(record['image'])
+        serializer = self.serializer_class(data=records, many=True, allow_empty=False, max_length=self.max_records)
+        if await asave(serializer):
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class EmployeeDailyAttendanceView(APIView):
+    serializer_class = EmployeeDailyAttendanceSerializer
+    pagination_class = DateCursorPagination
+
+    @swagger_auto_schema(
+        operation_summary='Get daily attendance summaries',
+        operation_description=(
+            'Get one row per employee and day with first and last detection, hours on site, '
+            'detection count, devices seen and best score, newest day first'
+        ),
+        query_serializer=EmployeeDailyAttendanceFilterSerializer,
+        responses={200: EmployeeDailyAttendanceSerializer(many=True)}
+    )
+    def get(self, request):
+        filters = EmployeeDailyAttendanceFilterSerializer(data=request.query_params)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            summaries = filters.filter_queryset(EmployeeDailyAttendanceModel.objects.all())
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(summaries, request, view=self)
+            serializer = EmployeeDailyAttendanceSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class EmployeeAttendanceDetailView(AsyncAPIView):
     serializer_class = EmployeeAttendanceSerializer
 
     @swagger_auto_schema(
@@ -139,9 +281,9 @@ class EmployeeAttendanceDetailView(APIView):
         operation_description='Get an attendance by ID',
         responses={200: EmployeeAttendanceSerializer}
     )
-    def get(self, request, pk):
+    async def get(self, request, pk):
         try:
-            attendance = EmployeeAttendanceModel.objects.get(pk=pk)
+            attendance = await EmployeeAttendanceModel.objects.aget(pk=pk)
             serializer = EmployeeAttendanceSerializer(attendance)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except EmployeeAttendanceModel.DoesNotExist:
@@ -154,12 +296,11 @@ class EmployeeAttendanceDetailView(APIView):
         operation_description='Update an attendance by ID',
         responses={200: EmployeeAttendanceSerializer}
     )
-    def put(self, request, pk):
+    async def put(self, request, pk):
         try:
-            attendance = EmployeeAttendanceModel.objects.get(pk=pk)
+            attendance = await EmployeeAttendanceModel.objects.aget(pk=pk)
             serializer = EmployeeAttendanceSerializer(attendance, data=request.data)
-            if serializer.is_valid():
-                serializer.save()
+            if await asave(serializer):
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except EmployeeAttendanceModel.DoesNotExist:
@@ -172,12 +313,19 @@ class EmployeeAttendanceDetailView(APIView):
         operation_description='Delete an attendance by ID',
         responses={204: 'Attendance deleted'}
     )
-    def delete(self, request, pk):
+    async def delete(self, request, pk):
         try:
-            attendance = EmployeeAttendanceModel.objects.get(pk=pk)
-            attendance.delete()
+            attendance = await EmployeeAttendanceModel.objects.aget(pk=pk)
+            await sync_to_async(self.remove)(attendance)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except EmployeeAttendanceModel.DoesNotExist:
             return Response({'detail': 'Attendance not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def remove(self, attendance):
+        with transaction.atomic():
+            attendance.delete()
+            EmployeeDailyAttendanceModel.objects.rebuild([
+                (attendance.employee_id, timezone.localdate(attendance.datetime)),
+            ])
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SharedappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sharedapp'
+
+    def ready(self):
+        from sharedapp.signals import connect_image_reference_handlers
+        connect_image_reference_handlers()
@@ -0,0 +1,31 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from attendify_drf.thumbnails import generate_thumbnail
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate missing thumbnails for every stored image, e.g. for images uploaded before thumbnails existed,'
+        ' and mark existing ones available again, e.g. after a cache flush'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size=1000, **options):
+        total = failed = 0
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, models.ImageField):
+                    continue
+                names = model._default_manager.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+                for name in names.values_list(field.name, flat=True).iterator(chunk_size=batch_size):
+                    try:
+                        generate_thumbnail(name, field.storage)
+                        total += 1
+                    except Exception as exc:
+                        failed += 1
+                        self.stderr.write(f'{name}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Checked {total} thumbnails, {failed} failed'))
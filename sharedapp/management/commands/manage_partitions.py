@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+from attendify_drf.cache import invalidate_cached_responses
+from sharedapp.management.commands.prune_events import CACHED_RESPONSES
+from sharedapp.partitions import (
+    ARCHIVE_SCHEMA, PARTITIONED_MODELS, add_months, create_partition, detach_partition, is_partitioned,
+    list_partitions, month_start, partition_name,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create upcoming monthly partitions of the attendance and visit history tables, '
+        'and detach partitions older than the retention period. Meant to run daily, e.g. from cron'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3, help='Future months to keep partitions ready for')
+        parser.add_argument(
+            '--retain-months', type=int,
+            help='Months to keep attached, including the current one; older partitions are detached',
+        )
+        parser.add_argument(
+            '--drop', action='store_true',
+            help=(
+                f'Drop detached partitions and delete their otherwise unused images, instead of moving them '
+                f'to the "{ARCHIVE_SCHEMA}" schema, where they keep their images'
+            ),
+        )
+
+    def handle(self, *args, months_ahead=3, retain_months=None, drop=False, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+        if retain_months is not None and retain_months < 1:
+            raise CommandError('--retain-months must be at least 1')
+        current = month_start(datetime.now(timezone.utc))
+
+        for label in PARTITIONED_MODELS:
+            model = apps.get_model(label)
+            table = model._meta.db_table
+            file_columns = [
+                field.column for field in model._meta.concrete_fields if isinstance(field, models.FileField)
+            ]
+            with transaction.atomic(), connection.cursor() as cursor:
+                if not is_partitioned(cursor, table):
+                    raise CommandError(f'{table} is not partitioned; run migrate first')
+                existing = set(list_partitions(cursor, table))
+                for offset in range(months_ahead + 1):
+                    month = add_months(current, offset)
+                    if month not in existing:
+                        create_partition(cursor, table, month)
+                        self.stdout.write(f'Created {partition_name(table, month)}')
+                if retain_months is not None:
+                    oldest_kept = add_months(current, 1 - retain_months)
+                    for month in sorted(existing):
+                        if month >= oldest_kept:
+                            break
+                        detach_partition(cursor, table, month, drop=drop, file_columns=file_columns)
+                        for namespace in CACHED_RESPONSES.get(label, ()):
+                            invalidate_cached_responses(namespace)
+                        if drop:
+                            self.stdout.write(f'Dropped {partition_name(table, month)}')
+                        else:
+                            self.stdout.write(f'Archived {partition_name(table, month)} to the {ARCHIVE_SCHEMA} schema')
+        self.stdout.write(self.style.SUCCESS('Partitions are up to date'))
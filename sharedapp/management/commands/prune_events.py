@@ -0,0 +1,90 @@
+import gzip
+import os
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import timezone
+
+from attendify_drf.cache import invalidate_cached_responses
+from attendify_drf.exports import encode_ndjson
+from sharedapp.models import ImageBlobModel
+
+EVENT_MODELS = ['employees.EmployeeAttendanceModel', 'clients.ClientVisitHistoryModel']
+# Namespaces of the cached responses embedding or aggregating the rows of an event model,
+# invalidated once its rows are removed without signals
+CACHED_RESPONSES = {'clients.ClientVisitHistoryModel': ('clients', 'client-analytics')}
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete attendances and client visits older than the retention period, in small throttled batches, '
+        'optionally archiving them to gzipped NDJSON first. Interrupted runs resume where they stopped. '
+        'Daily attendance summaries are kept. Whole months on partitioned tables are cheaper to remove '
+        'with manage_partitions --retain-months. Finally deletes image files left unreferenced for a day'
+    )
+
+    def add_arguments(self, parser):
+        options = getattr(settings, 'EVENT_RETENTION', {})
+        parser.add_argument('--days', type=int, default=options.get('DAYS', 365), help='Retention period in days')
+        parser.add_argument('--batch-size', type=int, default=options.get('BATCH_SIZE', 1000))
+        parser.add_argument(
+            '--sleep', type=float, default=options.get('SLEEP', 0.5), help='Seconds to pause between batches',
+        )
+        parser.add_argument('--max-runtime', type=float, help='Stop after this many seconds; the next run resumes')
+        parser.add_argument(
+            '--archive-dir',
+            help='Append deleted rows to <archive-dir>/<table>.ndjson.gz before deleting them',
+        )
+
+    def handle(self, *args, days, batch_size, sleep, max_runtime=None, archive_dir=None, **options):
+        if days < 1 or batch_size < 1:
+            raise CommandError('--days and --batch-size must be positive')
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+        cutoff = timezone.now() - timedelta(days=days)
+        deadline = time.monotonic() + max_runtime if max_runtime else None
+
+        for label in EVENT_MODELS:
+            model = apps.get_model(label)
+            deleted = self.prune(model, cutoff, batch_size, sleep, deadline, archive_dir)
+            if deleted:
+                for namespace in CACHED_RESPONSES.get(label, ()):
+                    invalidate_cached_responses(namespace)
+            self.stdout.write(f'Deleted {deleted} {model._meta.label} rows older than {cutoff:%Y-%m-%d %H:%M}')
+            if deadline and time.monotonic() >= deadline:
+                self.stdout.write(self.style.WARNING('Stopped at --max-runtime; run again to continue'))
+                return
+        ImageBlobModel.objects.sweep(timezone.now() - timedelta(days=1))
+        self.stdout.write(self.style.SUCCESS('Retention is up to date'))
+
+    def prune(self, model, cutoff, batch_size, sleep, deadline, archive_dir):
+        fields = [field.attname for field in model._meta.concrete_fields]
+        file_fields = [field.attname for field in model._meta.concrete_fields if isinstance(field, models.FileField)]
+        expired = model._default_manager.filter(datetime__lt=cutoff)
+        archive = os.path.join(archive_dir, f'{model._meta.db_table}.ndjson.gz') if archive_dir else None
+        deleted = 0
+        while True:
+            # Oldest first, so every batch is a narrow range of one partition/index page run
+            rows = list(expired.order_by('datetime', 'pk').values(*fields)[:batch_size])
+            if not rows:
+                return deleted
+            if archive:
+                # Appended as a new gzip member and flushed before the rows are deleted, so a crash
+                # in between at worst archives a batch twice
+                with gzip.open(archive, 'at', encoding='utf-8') as file:
+                    file.write(encode_ndjson(rows))
+            with transaction.atomic():
+                batch = expired.filter(pk__in=[row['id'] for row in rows], datetime__lte=rows[-1]['datetime'])
+                # A raw delete skips loading every row and per-row realtime events and cache invalidation
+                batch._raw_delete(batch.db)
+                ImageBlobModel.objects.release(
+                    [row[field] for row in rows for field in file_fields], delete_untracked=True,
+                )
+            deleted += len(rows)
+            if len(rows) < batch_size or (deadline and time.monotonic() >= deadline):
+                return deleted
+            time.sleep(sleep)
@@ -1,4 +1,10 @@
-from django.db import models
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage, storages
+from django.db import connections, models, transaction
+from django.db.models import F
+from django.utils import timezone
 
 
 class SharedModel(models.Model):
@@ -6,4 +12,109 @@ class SharedModel(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        abstract = True
\ No newline at end of file
+        abstract = True
+
+
+class ImageBlobQuerySet(models.QuerySet):
+    def retain(self, names):
+        """Adds one reference per occurrence of each name in ``names``, in a single upsert."""
+        self._upsert(Counter(name for name in names if name))
+
+    def touch(self, name):
+        """
+        Upserts the row of ``name`` without adding a reference. Uploads touch
+        their name before looking for an existing file, which waits for a
+        deletion of that file in progress and keeps a pending one from running.
+        """
+        self._upsert({name: 0})
+
+    def _upsert(self, counts):
+        if not counts:
+            return
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (name, ref_count, created_at, updated_at) VALUES '
+                + ', '.join(['(%s, %s, %s, %s)'] * len(counts))
+                + f' ON CONFLICT (name) DO UPDATE SET ref_count = {table}.ref_count + EXCLUDED.ref_count,'
+                  f' updated_at = EXCLUDED.updated_at',
+                [value for name, count in counts.items() for value in (name, count, now, now)],
+            )
+
+    def release(self, names, delete_untracked=False):
+        """
+        Drops one reference per occurrence of each name in ``names``. Files left
+        without references are deleted, along with their thumbnails, once the
+        transaction commits. Names that were never retained (files uploaded
+        before reference counting) are left alone unless ``delete_untracked``
+        is set, for callers that know nothing else uses them.
+        """
+        counts = Counter(name for name in names if name)
+        if not counts:
+            return
+        now = timezone.now()
+        released = {}
+        if delete_untracked:
+            untracked = set(counts) - set(self.filter(name__in=counts).values_list('name', flat=True))
+            released.update(dict.fromkeys(untracked, now))
+        names_by_count = defaultdict(list)
+        for name, count in counts.items():
+            names_by_count[count].append(name)
+        for count, group in names_by_count.items():
+            self.filter(name__in=group).update(ref_count=F('ref_count') - count, updated_at=now)
+        unreferenced = self.filter(name__in=counts, ref_count__lte=0).values_list('name', flat=True)
+        released.update(dict.fromkeys(unreferenced, now))
+        if released:
+            transaction.on_commit(lambda: self.delete_files(released), using=self.db)
+
+    def delete_files(self, released):
+        """
+        Deletes the files of the ``{name: released_at}`` rows that nothing has
+        retained or touched since their release, with their thumbnails. Each
+        row stays locked until its file is gone, so an upload of the same
+        content either touched it first and keeps the file, or waits and then
+        writes the file again.
+        """
+        from attendify_drf.thumbnails import thumbnail_key, thumbnail_name
+
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        for name, released_at in sorted(released.items()):
+            with transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    # Files uploaded before reference counting get a row to lock as well
+                    cursor.execute(
+                        f'INSERT INTO {table} (name, ref_count, created_at, updated_at) VALUES (%s, 0, %s, %s)'
+                        f' ON CONFLICT (name) DO NOTHING',
+                        [name, released_at, released_at],
+                    )
+                blob = self.select_for_update().filter(
+                    name=name, ref_count__lte=0, updated_at=released_at,
+                ).values_list('pk', flat=True).first()
+                if blob is None:
+                    continue
+                self.filter(pk=blob).delete()
+                default_storage.delete(name)
+                thumbnail = thumbnail_name(name)
+                cache.delete(thumbnail_key(thumbnail))
+                storages['thumbnails'].delete(thumbnail)
+
+    def sweep(self, before):
+        """
+        Deletes the files left unreferenced since before ``before``, e.g. touched
+        by an upload whose transaction then failed, or whose deletion was cut short.
+        """
+        self.delete_files(dict(self.filter(ref_count__lte=0, updated_at__lt=before).values_list('name', 'updated_at')))
+
+
+class ImageBlobModel(SharedModel):
+    """Reference count of a file in ``attendify_drf.storage.ContentAddressedStorage``."""
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.IntegerField(default=0)
+
+    objects = ImageBlobQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count})'
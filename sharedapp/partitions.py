@@ -0,0 +1,194 @@
+"""
+Monthly range partitioning of append-mostly event tables on their ``datetime``
+column (PostgreSQL only).
+
+Partitions are named ``<table>_pYYYYMM`` and cover one UTC calendar month;
+``<table>_default`` catches rows outside every partition. The primary key of a
+partitioned table must include the partition key, so it becomes
+``(id, datetime)`` in the database while Django keeps treating ``id`` as the
+primary key.
+"""
+from datetime import date, datetime, timezone
+
+PARTITIONED_MODELS = ['employees.EmployeeAttendanceModel', 'clients.ClientVisitHistoryModel']
+ARCHIVE_SCHEMA = 'archive'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def month_bound(month):
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc).isoformat()
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace",
+        [table],
+    )
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor, table):
+    """Months of the monthly partitions currently attached to ``table``, oldest first."""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = %s AND parent.relnamespace = current_schema()::regnamespace",
+        [table],
+    )
+    prefix = f'{table}_p'
+    months = []
+    for (name,) in cursor.fetchall():
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            months.append(date(int(suffix[:4]), int(suffix[4:]), 1))
+    return sorted(months)
+
+
+def create_partition(cursor, table, month):
+    """
+    Creates the partition for ``month`` unless it exists. Rows of that month
+    which already landed in the default partition are moved into it.
+    """
+    quote = cursor.db.ops.quote_name
+    name, default = partition_name(table, month), f'{table}_default'
+    if month in list_partitions(cursor, table):
+        return
+    start, end = month_bound(month), month_bound(add_months(month, 1))
+    in_month = f'"datetime" >= \'{start}\' AND "datetime" < \'{end}\''
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [default])
+    move_from_default = cursor.fetchone()[0]
+    if move_from_default:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {quote(default)} WHERE {in_month})')
+        move_from_default = cursor.fetchone()[0]
+    if move_from_default:
+        cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(default)}')
+    cursor.execute(
+        f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    if move_from_default:
+        cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(default)} WHERE {in_month}')
+        cursor.execute(f'DELETE FROM {quote(default)} WHERE {in_month}')
+        cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(default)} DEFAULT')
+
+
+def file_names(cursor, name, columns, batch_size=10000):
+    """Yields the file names stored in ``columns`` of table ``name``, a batch at a time."""
+    quote = cursor.db.ops.quote_name
+    last_id = 0
+    while columns:
+        cursor.execute(
+            f'SELECT "id", {", ".join(quote(column) for column in columns)} FROM {quote(name)} '
+            f'WHERE "id" > %s ORDER BY "id" LIMIT %s',
+            [last_id, batch_size],
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield [value for row in rows for value in row[1:] if value]
+        last_id = rows[-1][0]
+
+
+def detach_partition(cursor, table, month, drop=False, file_columns=()):
+    """
+    Detaches a month from ``table`` and moves it to the archive schema, or
+    drops it. Dropped rows release their references to the files in
+    ``file_columns`` (see ``ImageBlobModel``); archived rows keep them, so
+    their files stay until the archived table is dealt with.
+    """
+    from .models import ImageBlobModel
+
+    quote = cursor.db.ops.quote_name
+    name = partition_name(table, month)
+    cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+    # Archived rows must not keep employees and clients from being deleted
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'", [name])
+    for (constraint,) in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(constraint)}')
+    if drop:
+        # In the caller's transaction, so the references and the rows go together
+        for names in file_names(cursor, name, file_columns):
+            ImageBlobModel.objects.release(names, delete_untracked=True)
+        cursor.execute(f'DROP TABLE {quote(name)}')
+    else:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {quote(ARCHIVE_SCHEMA)}')
+        cursor.execute(f'ALTER TABLE {quote(name)} SET SCHEMA {quote(ARCHIVE_SCHEMA)}')
+
+
+def partition_table(cursor, table, months_ahead=3):
+    """
+    Rebuilds ``table`` as a partitioned table holding the same rows, indexes and
+    foreign keys, with monthly partitions from its oldest row up to
+    ``months_ahead`` months from now.
+    """
+    quote = cursor.db.ops.quote_name
+    if is_partitioned(cursor, table):
+        return
+    unpartitioned = f'{table}_unpartitioned'
+    sequence = f'{table}_id_seq'
+
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+        [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT pg_get_constraintdef(oid), conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(unpartitioned)}')
+    cursor.execute(
+        f'CREATE TABLE {quote(table)} (LIKE {quote(unpartitioned)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE ("datetime")'
+    )
+    # Identity columns can't be added to partitioned tables before PostgreSQL 17, so ids come from a sequence
+    cursor.execute(f'CREATE SEQUENCE {quote(sequence + "_partitioned")} OWNED BY {quote(table)}."id"')
+    cursor.execute(f'ALTER TABLE {quote(table)} ALTER COLUMN "id" SET DEFAULT nextval(\'{sequence}_partitioned\')')
+    cursor.execute(
+        f'SELECT setval(%s, COALESCE((SELECT MAX("id") FROM {quote(unpartitioned)}), 0) + 1, false)',
+        [sequence + '_partitioned'],
+    )
+
+    cursor.execute(f'SELECT MIN("datetime") FROM {quote(unpartitioned)}')
+    oldest = cursor.fetchone()[0]
+    current = month_start(datetime.now(timezone.utc))
+    month = month_start(oldest.astimezone(timezone.utc)) if oldest else current
+    while month <= add_months(current, months_ahead):
+        create_partition(cursor, table, month)
+        month = add_months(month, 1)
+    cursor.execute(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT')
+
+    cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(unpartitioned)}')
+    cursor.execute(f'DROP TABLE {quote(unpartitioned)}')
+    cursor.execute(f'ALTER SEQUENCE {quote(sequence + "_partitioned")} RENAME TO {quote(sequence)}')
+    cursor.execute(f'ALTER TABLE {quote(table)} ADD PRIMARY KEY ("id", "datetime")')
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for definition, name in foreign_keys:
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+
+
+def partition_model(model, months_ahead=3):
+    """Migration helper: ``RunPython`` callable factory partitioning ``app_label.Model``."""
+    def forwards(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        table = apps.get_model(model)._meta.db_table
+        with schema_editor.connection.cursor() as cursor:
+            partition_table(cursor, table, months_ahead)
+    return forwards
@@ -0,0 +1,53 @@
+from django.apps import apps
+from django.db import models
+from django.db.models.signals import post_delete, post_init, post_save
+
+from attendify_drf.storage import ContentAddressedStorage
+from .models import ImageBlobModel
+
+
+def content_addressed_fields(model):
+    return [
+        field.attname for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def image_post_init_handler(sender, instance, **kwargs):
+    # Raw column values as loaded; deferred fields are unknown and left out
+    instance._stored_files = {
+        field: instance.__dict__[field] or None for field in sender._stored_file_fields if field in instance.__dict__
+    }
+
+
+def image_post_save_handler(sender, instance, created, update_fields=None, **kwargs):
+    stored = instance._stored_files
+    retained, released = [], []
+    for field in sender._stored_file_fields:
+        if update_fields is not None and field not in update_fields:
+            continue
+        name = getattr(instance, field).name or None
+        previous = None if created else stored.get(field)
+        if name == previous:
+            continue
+        retained.append(name)
+        released.append(previous)
+        stored[field] = name
+    ImageBlobModel.objects.retain(retained)
+    ImageBlobModel.objects.release(released)
+
+
+def image_post_delete_handler(sender, instance, **kwargs):
+    ImageBlobModel.objects.release([getattr(instance, field).name for field in sender._stored_file_fields])
+
+
+def connect_image_reference_handlers():
+    """Keeps ImageBlobModel reference counts in step with every model storing files content-addressed."""
+    for model in apps.get_models():
+        fields = content_addressed_fields(model)
+        if not fields:
+            continue
+        model._stored_file_fields = fields
+        post_init.connect(image_post_init_handler, sender=model, dispatch_uid=f'stored-files-init-{model._meta.label}')
+        post_save.connect(image_post_save_handler, sender=model, dispatch_uid=f'stored-files-save-{model._meta.label}')
+        post_delete.connect(image_post_delete_handler, sender=model, dispatch_uid=f'stored-files-delete-{model._meta.label}')
@@ -1,3 +1,268 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from attendify_drf.live_stats import LiveStats
+from attendify_drf.renderers import ApiRenderer, OrjsonApiRenderer
+from clients.models import ClientModel, ClientVisitHistoryModel
+from employees.models import EmployeeModel, EmployeeAttendanceModel
+from .models import ImageBlobModel
+from .partitions import create_partition, list_partitions
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def upload(content=b'frame'):
+    return default_storage.save('employees/attendances/frame.jpg', ContentFile(content))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageBlobTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def release(self, names, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            ImageBlobModel.objects.release(names, **kwargs)
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        name = upload()
+        self.assertEqual(upload(), name)
+        ImageBlobModel.objects.retain([name, name])
+
+        self.release([name])
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlobModel.objects.get(name=name).ref_count, 1)
+
+        self.release([name])
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(ImageBlobModel.objects.filter(name=name).exists())
+
+    def test_upload_after_release_keeps_the_file(self):
+        name = upload()
+        ImageBlobModel.objects.retain([name])
+        with self.captureOnCommitCallbacks() as callbacks:
+            ImageBlobModel.objects.release([name])
+        # The same content is uploaded again before the release's deletion runs
+        self.assertEqual(upload(), name)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(default_storage.exists(name))
+        ImageBlobModel.objects.retain([name])
+        self.assertEqual(ImageBlobModel.objects.get(name=name).ref_count, 1)
+
+    def test_untracked_files_are_only_deleted_on_request(self):
+        name = FileSystemStorage().save('clients/legacy.jpg', ContentFile(b'legacy'))
+        self.release([name])
+        self.assertTrue(default_storage.exists(name))
+        self.release([name], delete_untracked=True)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_sweep_deletes_files_touched_but_never_retained(self):
+        name = upload()
+        ImageBlobModel.objects.filter(name=name).update(updated_at=timezone.now() - timedelta(days=2))
+        ImageBlobModel.objects.sweep(timezone.now() - timedelta(days=3))
+        self.assertTrue(default_storage.exists(name))
+        ImageBlobModel.objects.sweep(timezone.now() - timedelta(days=1))
+        self.assertFalse(default_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageBlobConcurrencyTests(TransactionTestCase):
+    def test_deletion_waits_for_an_upload_in_progress(self):
+        name = upload()
+        released_at = timezone.now()
+        # As left by the release of the file's last reference
+        ImageBlobModel.objects.filter(name=name).update(ref_count=0, updated_at=released_at)
+
+        def delete():
+            try:
+                ImageBlobModel.objects.delete_files({name: released_at})
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # A concurrent upload of the same content, not committed yet
+            self.assertEqual(upload(), name)
+            deleter = threading.Thread(target=delete)
+            deleter.start()
+            deleter.join(0.5)
+            self.assertTrue(deleter.is_alive())
+            ImageBlobModel.objects.retain([name])
+        deleter.join(5)
+        self.assertFalse(deleter.is_alive())
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlobModel.objects.get(name=name).ref_count, 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PartitionTests(TestCase):
+    table = EmployeeAttendanceModel._meta.db_table
+    month = date(2020, 1, 1)
+
+    def setUp(self):
+        self.employee = EmployeeModel.objects.create(
+            first_name='Ada', last_name='Lovelace', email='ada@example.com', phone_number='1',
+        )
+
+    def create_attendance(self, content):
+        return EmployeeAttendanceModel.objects.create(
+            employee=self.employee, device_id=1, score=0.5, image=ContentFile(content, 'frame.jpg'),
+            datetime=datetime(2020, 1, 15, tzinfo=dt_timezone.utc),
+        )
+
+    def partition_of(self, attendance):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT tableoid::regclass::text FROM {self.table} WHERE id = %s', [attendance.id])
+            return cursor.fetchone()[0]
+
+    def detach_old_months(self, *args):
+        with connection.cursor() as cursor:
+            # Deferred foreign key checks of the rows created in this test's transaction would block ALTER TABLE
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('manage_partitions', '--retain-months', '1', *args, stdout=StringIO())
+
+    def test_creating_a_partition_moves_its_rows_out_of_the_default_partition(self):
+        attendance = self.create_attendance(b'january')
+        self.assertEqual(self.partition_of(attendance), f'{self.table}_default')
+        with connection.cursor() as cursor:
+            create_partition(cursor, self.table, self.month)
+            self.assertIn(self.month, list_partitions(cursor, self.table))
+        self.assertEqual(self.partition_of(attendance), f'{self.table}_p202001')
+
+    def test_dropping_a_partition_releases_its_images(self):
+        with connection.cursor() as cursor:
+            create_partition(cursor, self.table, self.month)
+        kept = self.create_attendance(b'shared')
+        kept.datetime = timezone.now()
+        kept.save()
+        shared = self.create_attendance(b'shared').image.name
+        dropped = self.create_attendance(b'only january').image.name
+
+        self.detach_old_months('--drop')
+        self.assertEqual(list(EmployeeAttendanceModel.objects.values_list('id', flat=True)), [kept.id])
+        self.assertFalse(default_storage.exists(dropped))
+        self.assertFalse(ImageBlobModel.objects.filter(name=dropped).exists())
+        self.assertTrue(default_storage.exists(shared))
+        self.assertEqual(ImageBlobModel.objects.get(name=shared).ref_count, 1)
+
+    def test_archived_partitions_keep_their_images(self):
+        with connection.cursor() as cursor:
+            create_partition(cursor, self.table, self.month)
+        archived = self.create_attendance(b'january').image.name
+
+        self.detach_old_months()
+        self.assertFalse(EmployeeAttendanceModel.objects.exists())
+        self.assertTrue(default_storage.exists(archived))
+        self.assertEqual(ImageBlobModel.objects.get(name=archived).ref_count, 1)
+
+
+    def test_detaching_visit_partitions_invalidates_client_responses(self):
+        cache.clear()
+        table = ClientVisitHistoryModel._meta.db_table
+        with connection.cursor() as cursor:
+            create_partition(cursor, table, self.month)
+        client = ClientModel.objects.create(
+            first_seen=timezone.now(), last_seen=timezone.now(), gender='female', age=30, image='',
+        )
+        ClientVisitHistoryModel.objects.create(
+            client=client, device_id=1, datetime=datetime(2020, 1, 15, tzinfo=dt_timezone.utc),
+            ended_at=datetime(2020, 1, 15, tzinfo=dt_timezone.utc), device_ids=[1],
+        )
+        api = APIClient()
+        self.assertEqual(len(api.get(f'/clients/{client.id}/').json()['data']['visit_histories']), 1)
+
+        self.detach_old_months('--drop')
+        self.assertEqual(api.get(f'/clients/{client.id}/').json()['data']['visit_histories'], [])
+
+
+class LiveStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stats = LiveStats()
+
+    def test_detections_are_counted_off_the_request_thread(self):
+        now = timezone.now()
+        threads = []
+        record = self.stats._record
+
+        def spy(batches):
+            threads.append(threading.current_thread())
+            record(batches)
+
+        with mock.patch.object(self.stats, '_record', side_effect=spy), mock.patch.object(self.stats, 'push'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.stats.record('clients', [(1, 7, now), (2, 7, now)])
+                self.stats.record('clients', [(1, 8, now)])
+            self.stats.flush()
+
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+        clients = self.stats.snapshot()['clients']
+        self.assertEqual((clients['on_site'], clients['unique_today'], clients['visits_today']), (2, 2, 3))
+        self.assertEqual(clients['visits_today_by_device'], {7: 2, 8: 1})
+
+
+    def test_snapshots_are_pushed_without_a_transaction(self):
+        events = []
+        with mock.patch('attendify_drf.events.transaction') as events_transaction, \
+                mock.patch('attendify_drf.events.dispatcher._enqueue', side_effect=events.append):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.stats.record('employees', [(1, 7, timezone.now())])
+            self.stats.flush()
+        events_transaction.on_commit.assert_not_called()
+        [(_, event_name, data, groups)] = events
+        self.assertEqual((event_name, data['employees']['on_site']), ('live_stats', 1))
+
+
+class OrjsonApiRendererTests(SimpleTestCase):
+    data = {
+        'id': 1, 'name': 'Entrance', 'score': 0.5, 'tags': ['a', 'b'], 'total': Decimal('1.50'),
+        'label': gettext_lazy('Entrance'), 'datetime': datetime(2024, 1, 1, 8, 30, tzinfo=dt_timezone.utc),
+        'day': date(2024, 1, 1), 'duration': timedelta(minutes=5), 'empty': None, 'nested': {'items': [{'x': 1}]},
+    }
+
+    def render(self, renderer, data, status_code):
+        return json.loads(renderer.render(data, 'application/json', {'response': Response(status=status_code)}))
+
+    def assertSameEnvelope(self, data, status_code):
+        orjson_envelope = self.render(OrjsonApiRenderer(), data, status_code)
+        envelope = self.render(ApiRenderer(), data, status_code)
+        if 'metadata' in envelope:
+            # Rendered a moment apart
+            self.assertEqual(orjson_envelope['metadata'].keys(), envelope['metadata'].keys())
+            orjson_envelope['metadata']['timestamp'] = envelope['metadata']['timestamp']
+        self.assertEqual(orjson_envelope, envelope)
+        return envelope
+
+    def test_success_envelope_matches_api_renderer(self):
+        envelope = self.assertSameEnvelope(self.data, 200)
+        self.assertEqual((envelope['status'], envelope['code'], envelope['metadata']['version']), ('OK', 200, '1.0'))
+        self.assertSameEnvelope([self.data], 201)
+        self.assertSameEnvelope(None, 200)
+
+    def test_error_envelope_matches_api_renderer(self):
+        envelope = self.assertSameEnvelope({'image': ['This field is required.']}, 400)
+        self.assertEqual(envelope, {
+            'status': 'Bad Request', 'code': 400, 'errors': {'image': ['This field is required.']},
+        })
+        self.assertSameEnvelope({'detail': gettext_lazy('Not found.')}, 404)
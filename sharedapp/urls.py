@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import LiveStatsView
+
+urlpatterns = [
+    path('live/', LiveStatsView.as_view(), name='live_stats'),
+]
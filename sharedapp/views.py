@@ -1,3 +1,29 @@
-from django.shortcuts import render
+import logging
 
-# Create your views here.
+from adrf.views import APIView as AsyncAPIView
+from asgiref.sync import sync_to_async
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
+from rest_framework.response import Response
+
+from attendify_drf.live_stats import live_stats
+
+logger = logging.getLogger(__name__)
+
+
+class LiveStatsView(AsyncAPIView):
+    @swagger_auto_schema(
+        operation_summary='Get live occupancy and footfall',
+        operation_description=(
+            'Get the number of clients and employees currently on site, unique people seen today '
+            'and visits per device today and this hour. The same snapshot is pushed over the '
+            'WebSocket as the live_stats event.'
+        ),
+        responses={200: 'Live stats', 503: 'Counters unavailable'}
+    )
+    async def get(self, request):
+        try:
+            return Response(await sync_to_async(live_stats.snapshot)(), status=status.HTTP_200_OK)
+        except Exception:
+            logger.exception('Failed to read live stats')
+            return Response({'detail': 'Live stats are unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)